@@ -25,10 +25,211 @@
 import os
 import FreeCAD
 import Draft
+import BimFingerprint
+from BimIfcDiff import DiffResult
 from BimTranslateUtils import *
 
 def QT_TRANSLATE_NOOP(ctx,txt): return txt # dummy function for the QT translator
 
+MOVE_TOLERANCE = 0.2 # the max allowed move in mm
+VOL_TOLERANCE = 250 # the max allowed volume diff in mm^3
+
+
+def getCell(point,size):
+
+    "returns the integer coordinates of the cell of the given size containing a point"
+
+    import math
+    return (int(math.floor(point.x/size)),int(math.floor(point.y/size)),int(math.floor(point.z/size)))
+
+
+def getSpatialHash(objects,size):
+
+    """returns a dict of cell: [(position,obj,fingerprint)] with the given
+    objects, hashed by the center of their bound box in cells of the given size"""
+
+    cells = {}
+    for i,obj in enumerate(objects):
+        fingerprint = BimFingerprint.getFingerprint(obj)
+        if fingerprint and fingerprint.boundbox:
+            cells.setdefault(getCell(fingerprint.boundbox.Center,size),[]).append((i,obj,fingerprint))
+    return cells
+
+
+def getNeighbours(cells,point,size):
+
+    """returns the contents of the cell containing the given point and the 26
+    cells around it, in the order of the objects given to getSpatialHash.
+    Any object whose center lies at less than size from the point is in there"""
+
+    x,y,z = getCell(point,size)
+    found = []
+    for dx in (-1,0,1):
+        for dy in (-1,0,1):
+            for dz in (-1,0,1):
+                found.extend(cells.get((x+dx,y+dy,z+dz),[]))
+    found.sort(key=lambda item: item[0])
+    return found
+
+
+def sameBoundBox(bb1,bb2,tolerance):
+
+    "returns True if the corners of two bound boxes are closer than tolerance"
+
+    return abs(bb1.XMin - bb2.XMin) < tolerance and \
+           abs(bb1.YMin - bb2.YMin) < tolerance and \
+           abs(bb1.ZMin - bb2.ZMin) < tolerance
+
+
+def sameMaterial(obj1,obj2):
+
+    "returns True if two objects have materials with the same name, or no material"
+
+    mat1 = getattr(obj1,"Material",None)
+    mat2 = getattr(obj2,"Material",None)
+    if mat1 and mat2:
+        return mat1.Label == mat2.Label
+    return mat1 == mat2
+
+
+def diffObjects(mainobjs,newobjs,movetolerance=MOVE_TOLERANCE,voltolerance=VOL_TOLERANCE):
+
+    """compares two sets of objects and returns a DiffResult. BIM objects
+    are matched by their IFC ID. Objects of the main set without ID are
+    matched by their geometry with the new objects that have an ID. What is
+    compared: IDs, labels, IFC properties, geometry and materials"""
+
+    result = DiffResult()
+
+    # build lists of BIM objects with IFC ID
+
+    objswithoutid = [] # let's try to match these later on
+    mainids = {} # main set, the original freecad one
+    newids = {} # new set to be merged to the main one
+    mainmats = {} # existing materials
+    newmats = [] # materials of the new set
+    for obj in mainobjs:
+        if Draft.getType(obj) == "Material":
+            mainmats[obj.Label] = obj
+        elif hasattr(obj,"IfcData"):
+            if "IfcUID" in obj.IfcData:
+                mainids[obj.IfcData["IfcUID"]] = obj
+            elif obj.isDerivedFrom("Part::Feature"): # discard BuildingParts
+                objswithoutid.append(obj)
+    for obj in newobjs:
+        if Draft.getType(obj) == "Material":
+            newmats.append(obj)
+        elif hasattr(obj,"IfcData"):
+            if "IfcUID" in obj.IfcData:
+                newids[obj.IfcData["IfcUID"]] = obj
+
+    for id,obj in newids.items():
+        if id in mainids:
+            # this object already exists
+            mainobj = mainids[id]
+            if obj.Label != mainobj.Label:
+                result.add("renamed",mainobj,obj,obj.Label)
+            if obj.IfcProperties:
+                tree = BimFingerprint.getPropertyTree(obj)
+                maintree = BimFingerprint.getPropertyTree(mainobj)
+                if tree and maintree:
+                    # only the property sets whose hash differ are compared
+                    changes = maintree.getChanges(tree)
+                    if changes:
+                        result.add("propertieschanged",mainobj,obj,", ".join(changes))
+                elif obj.IfcProperties != mainobj.IfcProperties:
+                    # old-styled properties
+                    result.add("propertieschanged",mainobj,obj,"")
+            fingerprint = BimFingerprint.getFingerprint(obj)
+            mainfingerprint = BimFingerprint.getFingerprint(mainobj)
+            if fingerprint and mainfingerprint and fingerprint.boundbox and mainfingerprint.boundbox:
+                bb = fingerprint.boundbox
+                mainbb = mainfingerprint.boundbox
+                v = abs(fingerprint.volume - mainfingerprint.volume)
+                l = (bb.Center.sub(mainbb.Center)).Length
+                if v >= voltolerance:
+                    result.add("modified",mainobj,obj,v)
+                elif l >= movetolerance:
+                    result.add("moved",mainobj,obj,l)
+                elif not sameBoundBox(bb,mainbb,movetolerance):
+                    result.add("modified",mainobj,obj,v)
+                elif not sameMaterial(obj,mainobj):
+                    result.add("materialchanged",mainobj,obj,obj.Material.Label if obj.Material else "")
+                else:
+                    result.unchanged.append((mainobj,obj))
+            else:
+                result.add("noshape",mainobj,obj)
+        else:
+            result.add("added",None,obj)
+
+    for id,obj in mainids.items():
+        if not id in newids:
+            if obj.isDerivedFrom("Part::Feature"): # don't count building parts
+                result.add("removed",obj,None)
+
+    # try to find our objects without ID. Only the unmatched new objects whose
+    # center falls in a neighbouring cell can be within tolerance
+    unmatched = [(id,newobj) for id,newobj in newids.items() if not id in mainids]
+    cells = getSpatialHash([newobj for id,newobj in unmatched],movetolerance)
+    for obj in objswithoutid:
+        fingerprint = BimFingerprint.getFingerprint(obj)
+        if fingerprint.boundbox:
+            bb = fingerprint.boundbox
+            for i,newobj,newfingerprint in getNeighbours(cells,bb.Center,movetolerance):
+                if abs(newfingerprint.volume - fingerprint.volume) < voltolerance:
+                    if (newfingerprint.boundbox.Center.sub(bb.Center)).Length < movetolerance:
+                        if sameBoundBox(bb,newfingerprint.boundbox,movetolerance):
+                            # shapes are identical. It's the same object!
+                            result.add("newids",obj,newobj,unmatched[i][0])
+                            break
+            else:
+                result.add("removed",obj,None)
+        else:
+            result.add("removed",obj,None)
+
+    for obj in newmats:
+        if not obj.Label in mainmats:
+            result.add("newmaterials",None,obj,obj.Label)
+
+    return result
+
+
+def diffDocuments(maindoc,newdoc,visible=True,movetolerance=MOVE_TOLERANCE,voltolerance=VOL_TOLERANCE):
+
+    """compares the BIM objects and materials of two documents and returns a
+    DiffResult. If visible is True, only the visible objects are compared"""
+
+    def getObjects(doc):
+        objs = []
+        for obj in doc.Objects:
+            if visible and (Draft.getType(obj) != "Material") and obj.ViewObject and (not obj.ViewObject.Visibility):
+                continue
+            objs.append(obj)
+        return objs
+
+    return diffObjects(getObjects(maindoc),getObjects(newdoc),movetolerance,voltolerance)
+
+
+def diffFiles(mainfile,newfile,filename=None):
+
+    """opens two FreeCAD files, compares all their objects and returns the
+    DiffResult as a dict (see DiffResult.toDict), which is also written to
+    filename (JSON or CSV) if given. The files are closed afterwards, so it
+    can run without the GUI, for unattended revision checks"""
+
+    maindoc = FreeCAD.openDocument(mainfile)
+    newdoc = FreeCAD.openDocument(newfile)
+    try:
+        result = diffDocuments(maindoc,newdoc,visible=False)
+        if filename:
+            result.write(filename)
+        return result.toDict()
+    finally:
+        BimFingerprint.clearFingerprints(maindoc)
+        BimFingerprint.clearFingerprints(newdoc)
+        FreeCAD.closeDocument(maindoc.Name)
+        FreeCAD.closeDocument(newdoc.Name)
+
 
 class BIM_Diff:
 
@@ -54,10 +255,8 @@ class BIM_Diff:
         
         # what will be compared: IDs, geometry, materials. Everything else is discarded.
         
-        MOVE_TOLERANCE = 0.2 # the max allowed move in mm
-        VOL_TOLERANCE = 250 # the max allowed volume diff in mm^3
-        
         import FreeCADGui
+        import Part
         from PySide import QtCore,QtGui
         
         documents = FreeCAD.listDocuments()
@@ -72,123 +271,36 @@ class BIM_Diff:
                     otherdoc = list(documents.values())[1]
                 else:
                     otherdoc = list(documents.values())[0]
-            
-                # build lists of BIM objects with IFC ID
-                
-                objswithoutid = [] # let's try to match these later on
-            
-                activedocids = {} # main document, the original freecad one
-                for obj in activedoc.Objects:
-                    if hasattr(obj,"IfcData") and obj.ViewObject.Visibility:
-                        if "IfcUID" in obj.IfcData:
-                            activedocids[obj.IfcData["IfcUID"]] = obj
-                        elif obj.isDerivedFrom("Part::Feature"): # discard BuildingParts
-                            objswithoutid.append(obj)
-            
-                otherdocids = {} # other doc to be merged to the main one
-                for obj in otherdoc.Objects:
-                    if hasattr(obj,"IfcData") and obj.ViewObject.Visibility:
-                        if "IfcUID" in obj.IfcData:
-                            otherdocids[obj.IfcData["IfcUID"]] = obj
-            
-                toselect = [] # objects to select when finished
-                additions = [] # objects added
-                subtractions = [] # objects subtracted
-                modified = [] # objects modified
-                moved = [] # objects moved
-                matchanged = [] # object is same, but material changed
-                matchangedghost = [] # store shapes of objects whose material has changed to print a blue ghost later on
-                renamed = {} # object label changes
-                propertieschanged = {} # objects whose IFC properties are different
-            
-                for id,obj in otherdocids.items():
-                    if id in activedocids:
-                        # this object already exists                
-                        mainobj = activedocids[id]
-                        if obj.Label != mainobj.Label:
-                            # object has a different name
-                            renamed[mainobj.Name] = obj.Label
-                        if obj.IfcProperties and (obj.IfcProperties != mainobj.IfcProperties):
-                            # properties have changed
-                            propertieschanged[id] = obj.IfcProperties
-                        if hasattr(obj,"Shape") and hasattr(mainobj,"Shape"):
-                            v = abs(obj.Shape.Volume - mainobj.Shape.Volume)
-                            if v < VOL_TOLERANCE:
-                                # identical volume
-                                l = (obj.Shape.BoundBox.Center.sub(mainobj.Shape.BoundBox.Center)).Length
-                                if l < MOVE_TOLERANCE:
-                                    # identical position
-                                    if abs(obj.Shape.BoundBox.XMin - mainobj.Shape.BoundBox.XMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - mainobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - mainobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE:
-                                        # same boundbox
-                                        if hasattr(obj,"Material") and hasattr(mainobj,"Material") and (obj.Material and mainobj.Material and (obj.Material.Label == mainobj.Material.Label)) or (obj.Material == mainobj.Material):
-                                            # same material names
-                                            obj.ViewObject.hide()
-                                        else:
-                                            print("Object",mainobj.Label,"material has changed")
-                                            obj.ViewObject.hide() # we hide these objects since the shape hasn't changed but we keep their shapes
-                                            matchangedghost.append(obj.Shape)
-                                            matchanged.append(obj)
-                                    else:
-                                        print("Object",mainobj.Label,"shape bound box has changed")
-                                        toselect.append(obj)
-                                        modified.append(obj)
-                                else:
-                                    print("Object",mainobj.Label,"position has moved by",l,"mm")
-                                    toselect.append(obj)
-                                    moved.append(obj)
-                            else:
-                                print("Object",mainobj.Label,"shape has changed by",v,"mm^3")
-                                toselect.append(obj)
-                                modified.append(obj)
-                        else:
-                            print("Object",mainobj.Label,"one of the objects has no shape")
-                            toselect.append(obj)
-                    else:
-                        print("Object",obj.Label,"doesn't exist yet in main doc")
-                        toselect.append(obj)
-                        additions.append(obj)
-            
-                for id,obj in activedocids.items():
-                    if not id in otherdocids:
-                        if obj.isDerivedFrom("Part::Feature"): # don't count building parts
-                            print("Object",obj.Label,"doesn't exist anymore in new doc")
-                            subtractions.append(obj)
-                
-                # try to find our objects without ID
-                newids = {}
-                for obj in objswithoutid:
-                    for id,otherobj in otherdocids.items():
-                        if not id in activedocids:
-                            if abs(otherobj.Shape.Volume - obj.Shape.Volume) < VOL_TOLERANCE:
-                                if (otherobj.Shape.BoundBox.Center.sub(obj.Shape.BoundBox.Center)).Length < MOVE_TOLERANCE:
-                                    if abs(obj.Shape.BoundBox.XMin - otherobj.Shape.BoundBox.XMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - otherobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - otherobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE:
-                                           # shapes are identical. It's the same object!
-                                           newids[obj.Name] = id
-                                           break
-                    else:
-                        print("Object",obj.Label,"has no ID and wasn't found in the new doc")
-                        subtractions.append(obj)
-            
+
+                result = diffDocuments(activedoc,otherdoc)
+                for message in result.getMessages():
+                    print(message)
+
+                additions = [obj for mainobj,obj,value in result.get("added")]
+                subtractions = [mainobj for mainobj,obj,value in result.get("removed")]
+                modified = result.get("modified")
+                moved = result.get("moved")
+                matchanged = result.get("materialchanged")
+                newmats = [obj for mainobj,obj,value in result.get("newmaterials")]
+
+                # we hide the objects whose shape hasn't changed, but we keep the shapes
+                # of those whose material has changed to print a blue ghost later on
+                for mainobj,obj in result.unchanged:
+                    obj.ViewObject.hide()
+                for mainobj,obj,value in matchanged:
+                    obj.ViewObject.hide()
+                matchangedghost = [obj.Shape for mainobj,obj,value in matchanged]
+
+                toselect = additions + [obj for mainobj,obj,value in modified+moved+result.get("noshape")] + newmats
+
                 matnames = {} # existing materials
                 for obj in activedoc.Objects:
                     if Draft.getType(obj) == "Material":
                         matnames[obj.Label] = obj
             
-                newmats = {} # new materials
-                for obj in otherdoc.Objects:
-                    if Draft.getType(obj) == "Material":
-                        if not obj.Label in matnames:
-                            print("Material",obj.Label,"doesn't exist in main doc")
-                            toselect.append(obj)
-                            newmats[obj.Label] = obj
-            
                 if newmats:
                     group = otherdoc.addObject("App::DocumentObjectGroup","New_materials")
-                    for newmat in newmats.values():
+                    for newmat in newmats:
                         group.addObject(newmat)
             
                 if toselect:
@@ -218,7 +330,7 @@ class BIM_Diff:
                     obj.ViewObject.Transparency = 60
             
                 if modified:
-                    shape = Part.makeCompound([m.Shape for m in modified])
+                    shape = Part.makeCompound([m.Shape for mainobj,m,value in modified])
                     obj = activedoc.addObject("Part::Feature","Modified")
                     obj.Shape = shape
                     obj.ViewObject.LineWidth = 5
@@ -227,7 +339,7 @@ class BIM_Diff:
                     obj.ViewObject.Transparency = 60
         
                 if moved:
-                    shape = Part.makeCompound([m.Shape for m in moved])
+                    shape = Part.makeCompound([m.Shape for mainobj,m,value in moved])
                     obj = activedoc.addObject("Part::Feature","Moved")
                     obj.Shape = shape
                     obj.ViewObject.LineWidth = 5
@@ -247,10 +359,9 @@ class BIM_Diff:
                 if matchanged:
                     reply = QtGui.QMessageBox.question(None, "", str(len(matchanged))+" "+translate("BIM","objects still have the same shape but have a different material. Do you wish to update them in the main document?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for obj in matchanged:
+                        for mainobj,obj,value in matchanged:
                             mat = obj.Material
                             if mat:
-                                mainobj = activedocids[obj.IfcData["IfcUID"]]
                                 if mainobj.Material:
                                     mainmatlabel = mainobj.Material.Label
                                 else:
@@ -271,47 +382,39 @@ class BIM_Diff:
                                     mainobj.Material = newmat
                                     matnames[newmat.Label] = newmat
                 
-                if newids:
-                    reply = QtGui.QMessageBox.question(None, "", str(len(newids))+" "+translate("BIM","objects have no IFC ID in the main document, but an identical object with an ID exists in the new document. Transfer these IDs to the original objects?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+                if result.get("newids"):
+                    reply = QtGui.QMessageBox.question(None, "", str(len(result.get("newids")))+" "+translate("BIM","objects have no IFC ID in the main document, but an identical object with an ID exists in the new document. Transfer these IDs to the original objects?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for name,id in newids.items():
-                            obj = activedoc.getObject(name)
-                            if obj:
-                                print("Transferring new id to object",obj.Label)
-                                a = obj.IfcData
-                                a["IfcUID"] = id
-                                obj.IfcData = a
+                        for obj,newobj,id in result.get("newids"):
+                            print("Transferring new id to object",obj.Label)
+                            a = obj.IfcData
+                            a["IfcUID"] = id
+                            obj.IfcData = a
         
-                if renamed:
-                    reply = QtGui.QMessageBox.question(None, "", str(len(renamed))+" "+translate("BIM","objects had their name changed. Rename them?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+                if result.get("renamed"):
+                    reply = QtGui.QMessageBox.question(None, "", str(len(result.get("renamed")))+" "+translate("BIM","objects had their name changed. Rename them?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for name,label in renamed.items():
-                            obj = activedoc.getObject(name)
-                            if obj:
-                                print("Renaming object",obj.Label,"to",label)
-                                obj.Label = label
+                        for obj,newobj,label in result.get("renamed"):
+                            print("Renaming object",obj.Label,"to",label)
+                            obj.Label = label
         
-                if propertieschanged:
-                    reply = QtGui.QMessageBox.question(None, "", str(len(propertieschanged))+" "+translate("BIM","objects had their properties changed. Update?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+                if result.get("propertieschanged"):
+                    reply = QtGui.QMessageBox.question(None, "", str(len(result.get("propertieschanged")))+" "+translate("BIM","objects had their properties changed. Update?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for id,prop in propertieschanged.items():
-                            obj = activedocids[id]
+                        for obj,newobj,value in result.get("propertieschanged"):
                             print("Updating properties of ",obj.Label)
-                            obj.IfcProperties = prop
+                            obj.IfcProperties = newobj.IfcProperties
         
                 if moved:
                     reply = QtGui.QMessageBox.question(None, "", str(len(moved))+" "+translate("BIM","objects have their location changed. Move them to their new position?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for obj in moved:
-                            mainobj = activedocids[obj.IfcData["IfcUID"]]
-                            otherobj = otherdocids[obj.IfcData["IfcUID"]]
-                            delta = otherobj.Shape.BoundBox.Center.sub(mainobj.Shape.BoundBox.Center)
+                        for mainobj,otherobj,value in moved:
+                            delta = BimFingerprint.getFingerprint(otherobj).boundbox.Center.sub(BimFingerprint.getFingerprint(mainobj).boundbox.Center)
                             print("Moving object ",mainobj.Label)
                             Draft.move(mainobj,delta)
                     reply = QtGui.QMessageBox.question(None, "", translate("BIM","Do you wish to colorize the objects that have moved in yellow in the other file (to serve as a diff)?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for obj in moved:
-                            otherobj = otherdocids[obj.IfcData["IfcUID"]]
+                        for mainobj,otherobj,value in moved:
                             try:
                                 otherobj.ViewObject.LineColor = (1.0,1.0,0.0)
                                 otherobj.ViewObject.ShapeColor = (1.0,1.0,0.0)
@@ -322,8 +425,7 @@ class BIM_Diff:
                 if modified:
                     reply = QtGui.QMessageBox.question(None, "", translate("BIM","Do you wish to colorize the objects that have been modified in orange in the other file (to serve as a diff)?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for obj in modified:
-                            otherobj = otherdocids[obj.IfcData["IfcUID"]]
+                        for mainobj,otherobj,value in modified:
                             try:
                                 otherobj.ViewObject.LineColor = (1.0,0.5,0.0)
                                 otherobj.ViewObject.ShapeColor = (1.0,0.5,0.0)
@@ -350,8 +452,7 @@ class BIM_Diff:
                 if additions:
                     reply = QtGui.QMessageBox.question(None, "", translate("BIM","Do you wish to colorize the objects that have been added in green in the other file (to serve as a diff)?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for obj in additions:
-                            otherobj = otherdocids[obj.IfcData["IfcUID"]]
+                        for otherobj in additions:
                             try:
                                 otherobj.ViewObject.LineColor = (0.0,1.0,0.0)
                                 otherobj.ViewObject.ShapeColor = (0.0,1.0,0.0)
@@ -360,4 +461,43 @@ class BIM_Diff:
                                 print(otherobj.Label,"cannot be colorized")
 
         else:
-            QtGui.QMessageBox.information(None,"",translate("BIM","You need two documents open to run this tool. One which is your main document, and one that contains new objects that you wish to compare against the existing one. Make sure only the objects you wish to compare in both documents are visible."))
+            reply = QtGui.QMessageBox.question(None, "", translate("BIM","You need two documents open to run this tool. One which is your main document, and one that contains new objects that you wish to compare against the existing one. Make sure only the objects you wish to compare in both documents are visible.")+"\n\n"+translate("BIM","Do you wish to compare two IFC files directly instead, without opening them?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+            if reply == QtGui.QMessageBox.Yes:
+                self.diffIfcFiles()
+
+    def diffIfcFiles(self):
+
+        "compares two IFC files with BimIfcDiff, prints the differences and offers to save them"
+
+        from PySide import QtCore,QtGui
+        import BimIfcDiff
+        lastfolder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcDiffFolder","")
+        mainfile = QtGui.QFileDialog.getOpenFileName(None,translate("BIM","Select the main IFC file"),lastfolder,translate("BIM","IFC files (*.ifc)"))
+        if not (mainfile and mainfile[0]):
+            return
+        mainfile = mainfile[0]
+        lastfolder = os.path.dirname(mainfile)
+        newfile = QtGui.QFileDialog.getOpenFileName(None,translate("BIM","Select the new IFC file"),lastfolder,translate("BIM","IFC files (*.ifc)"))
+        if not (newfile and newfile[0]):
+            return
+        newfile = newfile[0]
+        FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetString("lastIfcDiffFolder",lastfolder)
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            result = BimIfcDiff.diffIfcFiles(mainfile,newfile)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        for message in result.getMessages():
+            FreeCAD.Console.PrintMessage(message+"\n")
+        if result.isEmpty():
+            QtGui.QMessageBox.information(None,"",translate("BIM","No difference found between these files"))
+            return
+        reply = QtGui.QMessageBox.question(None, "", str(len(result.getRows()))+" "+translate("BIM","differences found. Save them to a file?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+        if reply == QtGui.QMessageBox.Yes:
+            filename = QtGui.QFileDialog.getSaveFileName(None,translate("BIM","Save differences"),lastfolder,translate("BIM","JSON files (*.json);;CSV files (*.csv)"))
+            if filename and filename[0]:
+                filename = filename[0]
+                if not os.path.splitext(filename)[1].lower() in [".json",".csv"]:
+                    filename += ".json"
+                result.write(filename)
+                FreeCAD.Console.PrintMessage(translate("BIM","Differences saved to")+" "+filename+"\n")
@@ -0,0 +1,196 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains a cache of the geometric fingerprints of the shapes
+of document objects, shared by the tools that compare or summarize geometry
+(BIM_Diff, BIM_Preflight, BIM_IfcQuantities), and of the hash trees of
+their IFC properties"""
+
+import FreeCAD
+
+FINGERPRINTS = {} # (document name, object name): (shape hash, Fingerprint)
+PROPERTYTREES = {} # (document name, object name): PropertyHashTree
+OBSERVER = None   # the FingerprintObserver, once installed
+
+# field name: (function computing it from a shape, value for null shapes)
+FIELDS = {"volume":   (lambda shape: shape.Volume,0),
+          "area":     (lambda shape: shape.Area,0),
+          "boundbox": (lambda shape: shape.BoundBox,None),
+          "center":   (lambda shape: getCenterOfMass(shape),None),
+          "vertexes": (lambda shape: len(shape.Vertexes),0),
+          "edges":    (lambda shape: len(shape.Edges),0),
+          "faces":    (lambda shape: len(shape.Faces),0),
+          "solids":   (lambda shape: len(shape.Solids),0),
+         }
+
+
+class Fingerprint:
+
+    """The geometric fingerprint of a shape: its volume, area, bound box,
+    center of mass and number of vertexes, edges, faces and solids. Each of
+    them is only computed the first time it is read. Null shapes have no
+    bound box and no center"""
+
+    def __init__(self,shape):
+
+        self.shape = shape
+        self.null = shape.isNull()
+
+
+    def __getattr__(self,name):
+
+        "computes a field of the fingerprint and keeps it"
+
+        if not name in FIELDS:
+            raise AttributeError(name)
+        function,default = FIELDS[name]
+        value = default if self.null else function(self.shape)
+        setattr(self,name,value)
+        return value
+
+
+class FingerprintObserver:
+
+    "A document observer that drops the fingerprints of objects when they change"
+
+    def slotChangedObject(self,obj,prop):
+
+        FINGERPRINTS.pop((obj.Document.Name,obj.Name),None)
+        PROPERTYTREES.pop((obj.Document.Name,obj.Name),None)
+
+    def slotDeletedObject(self,obj):
+
+        FINGERPRINTS.pop((obj.Document.Name,obj.Name),None)
+        PROPERTYTREES.pop((obj.Document.Name,obj.Name),None)
+
+    def slotDeletedDocument(self,doc):
+
+        clearFingerprints(doc)
+
+
+def getCenterOfMass(shape):
+
+    """returns the center of mass of a shape. Shapes without one (compounds
+    in older versions, shapes without volume) give the center of their bound box"""
+
+    if shape.Solids:
+        try:
+            if len(shape.Solids) == 1:
+                return shape.Solids[0].CenterOfMass
+            total = sum([solid.Volume for solid in shape.Solids])
+            if total:
+                center = FreeCAD.Vector()
+                for solid in shape.Solids:
+                    center = center.add(solid.CenterOfMass.multiply(solid.Volume))
+                return center.multiply(1.0/total)
+        except (AttributeError,RuntimeError):
+            pass
+    return shape.BoundBox.Center
+
+
+def getFingerprint(obj):
+
+    """returns the Fingerprint of the shape of a document object, or None if
+    it has no shape. It is computed once per shape, and computed again when
+    the object is touched, changed or gets a new shape"""
+
+    if not hasattr(obj,"Shape"):
+        return None
+    setupObserver()
+    key = (obj.Document.Name,obj.Name)
+    shape = obj.Shape
+    identity = shape.hashCode()
+    if (key in FINGERPRINTS) and (not obj.isTouched()):
+        cached,fingerprint = FINGERPRINTS[key]
+        if cached == identity:
+            return fingerprint
+    fingerprint = Fingerprint(shape)
+    if obj.isTouched():
+        # the shape is about to be recomputed
+        FINGERPRINTS.pop(key,None)
+    else:
+        FINGERPRINTS[key] = (identity,fingerprint)
+    return fingerprint
+
+
+def getPropertySets(props):
+
+    """returns a dict of property set name: {property name: value} from the
+    contents of an IfcProperties map, in 0.18 (name: "pset;;type;;value")
+    or 0.19 ("name;;pset": "type;;value") format"""
+
+    psets = {}
+    for key,value in props.items():
+        value = value.split(";;")
+        if ";;" in key:
+            # 0.19 format
+            name,pset = key.split(";;",1)
+        elif len(value) == 3:
+            name,pset,value = key,value[0],value[1:]
+        else:
+            name,pset = key,""
+        psets.setdefault(pset,{})[name] = ";;".join(value)
+    return psets
+
+
+def getPropertyTree(obj):
+
+    """returns the BimIfcDiff.PropertyHashTree of the IfcProperties of a
+    document object, or None if it has none or old-styled ones. It is
+    computed once, and computed again when the object changes"""
+
+    props = getattr(obj,"IfcProperties",None)
+    if not isinstance(props,dict):
+        return None
+    import BimIfcDiff
+    key = (obj.Document.Name,obj.Name)
+    if key in PROPERTYTREES:
+        return PROPERTYTREES[key]
+    tree = BimIfcDiff.PropertyHashTree(getPropertySets(props))
+    if setupObserver():
+        # without observer, nothing would tell when the properties change
+        PROPERTYTREES[key] = tree
+    return tree
+
+
+def clearFingerprints(doc=None):
+
+    "removes the fingerprints and property trees of the objects of the given document, or all of them"
+
+    for cache in [FINGERPRINTS,PROPERTYTREES]:
+        if doc is None:
+            cache.clear()
+        else:
+            for key in [key for key in cache if key[0] == doc.Name]:
+                del cache[key]
+
+
+def setupObserver():
+
+    """installs the observer that keeps the fingerprints up to date, once.
+    Returns True if the observer is installed"""
+
+    global OBSERVER
+    if (OBSERVER is None) and hasattr(FreeCAD,"addDocumentObserver"):
+        OBSERVER = FingerprintObserver()
+        FreeCAD.addDocumentObserver(OBSERVER)
+    return OBSERVER is not None
@@ -0,0 +1,457 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains the diff results shared by BIM_Diff and a diff of
+two IFC files that works directly on the files with ifcopenshell, without
+importing them. Products are matched by GlobalId, and their attributes,
+property sets, materials, placements and geometry are compared. Geometry
+is compared through a signature of the entities that define it, without
+tessellating anything. It needs ifcopenshell and numpy but not FreeCAD,
+and can be run from the command line:
+
+    python BimIfcDiff.py [--output FILE.json|FILE.csv] main.ifc new.ifc
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import hashlib
+
+import BimIfcIndex
+
+MOVE_TOLERANCE = 0.2 # the max allowed move in mm
+ROTATION_TOLERANCE = 0.0001 # the max allowed difference of the rotation matrix terms
+IGNORED = ["GlobalId","OwnerHistory","Name","ObjectPlacement","Representation"] # attributes not compared directly
+
+# the kinds of differences found between two sets of objects, in report order
+CHANGES = ["added",             # objects of the new set that don't exist in the main one
+           "removed",           # objects of the main set that don't exist in the new one
+           "modified",          # objects whose volume or bound box changed
+           "moved",             # objects with the same shape at another position
+           "materialchanged",   # objects with the same shape and another material
+           "renamed",           # objects whose label changed
+           "propertieschanged", # objects whose IFC properties changed
+           "attributeschanged", # objects whose IFC attributes changed
+           "newids",            # objects without ID identical to a new object with an ID
+           "newmaterials",      # materials that don't exist in the main set
+           "noshape",           # objects whose geometry cannot be compared
+          ]
+
+
+class DiffResult:
+
+    """The differences between a main set of objects and a newer one. Each
+    kind of change of CHANGES holds a list of (mainobj,newobj,value) tuples,
+    where mainobj or newobj is None if the object only exists on one side.
+    value is the move distance of moved objects in mm, the volume difference
+    of modified objects (document objects only), the new label of renamed
+    objects and materials, the names of the changed attributes and
+    properties, and the transferable ID of newids. Objects found identical
+    are kept in unchanged, but not reported"""
+
+    def __init__(self):
+
+        self.changes = dict([(change,[]) for change in CHANGES])
+        self.unchanged = []
+
+
+    def add(self,change,mainobj,newobj,value=None):
+
+        "records a change of the given kind"
+
+        self.changes[change].append((mainobj,newobj,value))
+
+
+    def get(self,change):
+
+        "returns the (mainobj,newobj,value) tuples of a kind of change"
+
+        return self.changes[change]
+
+
+    def isEmpty(self):
+
+        "returns True if no difference was found"
+
+        return not any(self.changes.values())
+
+
+    def describe(self,obj):
+
+        "returns the IFC ID, name and label of an object, or empty strings"
+
+        if obj is None:
+            return "","",""
+        ifcid = ""
+        if hasattr(obj,"IfcData"):
+            ifcid = obj.IfcData.get("IfcUID","")
+        return ifcid,obj.Name,obj.Label
+
+
+    def getRows(self):
+
+        """returns the differences as a list of (change,id,name,label,newname,
+        newlabel,value) tuples, in the order of CHANGES"""
+
+        rows = []
+        for change in CHANGES:
+            for mainobj,newobj,value in self.changes[change]:
+                ifcid,name,label = self.describe(mainobj)
+                newid,newname,newlabel = self.describe(newobj)
+                if value is None:
+                    value = ""
+                rows.append((change,ifcid or newid,name,label,newname,newlabel,value))
+        return rows
+
+
+    def getMessages(self):
+
+        "returns the differences as a list of readable lines"
+
+        messages = []
+        for change,ifcid,name,label,newname,newlabel,value in self.getRows():
+            if change == "added":
+                messages.append("Object "+newlabel+" doesn't exist yet in main doc")
+            elif change == "removed":
+                messages.append("Object "+label+" doesn't exist anymore in new doc")
+            elif change == "modified":
+                if value == "":
+                    messages.append("Object "+label+" shape has changed")
+                else:
+                    messages.append("Object "+label+" shape has changed, volume difference: "+str(value)+" mm^3")
+            elif change == "moved":
+                messages.append("Object "+label+" position has moved by "+str(value)+" mm")
+            elif change == "materialchanged":
+                messages.append("Object "+label+" material has changed")
+            elif change == "renamed":
+                messages.append("Object "+label+" was renamed to "+newlabel)
+            elif change == "propertieschanged":
+                if value:
+                    messages.append("Object "+label+" properties have changed: "+value)
+                else:
+                    messages.append("Object "+label+" properties have changed")
+            elif change == "attributeschanged":
+                messages.append("Object "+label+" attributes have changed: "+value)
+            elif change == "newids":
+                messages.append("Object "+label+" has no ID but is identical to "+value)
+            elif change == "newmaterials":
+                messages.append("Material "+newlabel+" doesn't exist in main doc")
+            elif change == "noshape":
+                messages.append("Object "+label+" one of the objects has no shape")
+        return messages
+
+
+    def toDict(self):
+
+        "returns the differences as a dict of change: [dict], usable as JSON"
+
+        keys = ["id","name","label","newname","newlabel","value"]
+        result = dict([(change,[]) for change in CHANGES])
+        for row in self.getRows():
+            result[row[0]].append(dict(zip(keys,row[1:])))
+        return result
+
+
+    def writeJSON(self,filename):
+
+        "writes the differences to a JSON file"
+
+        with open(filename,"w") as f:
+            json.dump(self.toDict(),f,indent=1,default=str)
+
+
+    def writeCSV(self,filename):
+
+        "writes the differences to a CSV file, one line per change"
+
+        import BimIfcUtils
+        BimIfcUtils.writeCSV(filename,["Change","Id","Name","Label","New name","New label","Value"],self.getRows())
+
+
+    def write(self,filename):
+
+        "writes the differences to a CSV file if filename ends with .csv, JSON otherwise"
+
+        if filename.lower().endswith(".csv"):
+            self.writeCSV(filename)
+        else:
+            self.writeJSON(filename)
+
+
+class IfcDiffResult(DiffResult):
+
+    "A DiffResult between the products of two IFC files"
+
+    def describe(self,entity):
+
+        "returns the GlobalId, #id and name of an IFC entity, or empty strings"
+
+        if entity is None:
+            return "","",""
+        return getattr(entity,"GlobalId",""),"#"+str(entity.id()),getattr(entity,"Name",None) or ""
+
+
+class PropertyHashTree:
+
+    """A hash tree of the property sets of an object: each property value
+    has a hash, each property set the hash of its properties, and the object
+    the hash of its property sets. Two objects with the same root hash have
+    the same properties, and when they differ, only the property sets with
+    a different hash need to be looked into. psets is a dict of property
+    set name: {property name: value}, values being JSON-compatible"""
+
+    def __init__(self,psets):
+
+        self.properties = {} # pset name: {property name: hash}
+        self.psets = {}      # pset name: hash
+        for pset,props in psets.items():
+            self.properties[pset] = dict([(prop,getHash(json.dumps(value,sort_keys=True,default=str))) for prop,value in props.items()])
+            self.psets[pset] = getHash(json.dumps(sorted(self.properties[pset].items())))
+        self.hash = getHash(json.dumps(sorted(self.psets.items())))
+
+
+    def getChanges(self,other):
+
+        """returns the sorted "pset.property" names of the properties that are
+        different, missing or added in another PropertyHashTree. Properties
+        without property set are given by their name only"""
+
+        changes = []
+        if self.hash == other.hash:
+            return changes
+        for pset in sorted(set(self.psets) | set(other.psets)):
+            if self.psets.get(pset) != other.psets.get(pset):
+                props = self.properties.get(pset,{})
+                otherprops = other.properties.get(pset,{})
+                for prop in sorted(set(props) | set(otherprops)):
+                    if props.get(prop) != otherprops.get(prop):
+                        changes.append(pset+"."+prop if pset else prop)
+        return changes
+
+
+class IfcDiffFile:
+
+    """One of the two IFC files compared by diffIfcFiles, with the indexes
+    needed to compare its products"""
+
+    def __init__(self,filename):
+
+        import ifcopenshell
+        self.ifc = ifcopenshell.open(filename)
+        self.psetindex = BimIfcIndex.IfcPropertyIndex(self.ifc)
+        self.trees = {} # product id: PropertyHashTree
+        import ifcopenshell.util.unit
+        self.scale = ifcopenshell.util.unit.calculate_unit_scale(self.ifc) * 1000 # mm per file unit
+        self.products = {} # GlobalId: product
+        for product in self.ifc.by_type("IfcProduct"):
+            self.products[product.GlobalId] = product
+        self.materials = {} # product id: sorted material names
+        names = {} # material definition id: material names
+        for rel in self.ifc.by_type("IfcRelAssociatesMaterial"):
+            material = rel.RelatingMaterial
+            if not material:
+                continue
+            if not material.id() in names:
+                names[material.id()] = [e.Name for e in self.ifc.traverse(material) if e.is_a("IfcMaterial")]
+            for obj in rel.RelatedObjects:
+                self.materials.setdefault(obj.id(),set()).update(names[material.id()])
+        for eid,mats in self.materials.items():
+            self.materials[eid] = sorted(mats)
+
+
+    def getMaterials(self,product):
+
+        "returns the sorted names of the materials associated with a product"
+
+        return self.materials.get(product.id(),[])
+
+
+    def getMaterialNames(self):
+
+        "returns the names of all the materials of the file"
+
+        return set([m.Name for m in self.ifc.by_type("IfcMaterial")])
+
+
+    def getAttributes(self,product):
+
+        """returns a dict of name: value key of the attributes of a product,
+        except those of IGNORED, which are compared separately"""
+
+        attributes = {}
+        for name in BimIfcIndex.getAttributeNames(self.ifc,product):
+            if not name in IGNORED:
+                attributes[name] = getValueKey(getattr(product,name))
+        return attributes
+
+
+    def getPropertySets(self,product):
+
+        "returns a dict of property set name: {property name: value} of a product"
+
+        import BimIfcExplorerCore
+        psets = {}
+        for pset,props in BimIfcExplorerCore.getPropertySets(self.ifc,self.psetindex,product.id()):
+            psets[pset.Name] = dict([(prop.Name,BimIfcExplorerCore.getPropertyValue(self.ifc,prop)) for prop in props])
+        return psets
+
+
+    def getPropertyTree(self,product):
+
+        "returns the PropertyHashTree of a product, computed once"
+
+        if not product.id() in self.trees:
+            self.trees[product.id()] = PropertyHashTree(self.getPropertySets(product))
+        return self.trees[product.id()]
+
+
+    def getPlacement(self,product):
+
+        "returns the absolute placement matrix of a product, in mm, or None"
+
+        if not product.ObjectPlacement:
+            return None
+        import ifcopenshell.util.placement
+        matrix = ifcopenshell.util.placement.get_local_placement(product.ObjectPlacement)
+        matrix[:3,3] *= self.scale
+        return matrix
+
+
+    def getSignature(self,product):
+
+        "returns the geometry signature of a product, independent of its placement, or None"
+
+        if not product.Representation:
+            return None
+        import BimIfcTessellation
+        return BimIfcTessellation.getGeometrySignature(self.ifc,product,placement=False)
+
+
+def getHash(text):
+
+    "returns the sha1 hash of a text"
+
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+def getValueKey(value):
+
+    """returns a comparable key for an attribute value that doesn't depend
+    on the numbering of the file: entities with a GlobalId give their
+    GlobalId, other entities their type and the keys of their attributes"""
+
+    if isinstance(value,(list,tuple)):
+        return tuple([getValueKey(v) for v in value])
+    if hasattr(value,"is_a"):
+        if not value.id():
+            return (value.is_a(),getValueKey(value.wrappedValue))
+        if hasattr(value,"GlobalId"):
+            return value.GlobalId
+        return (value.is_a(),tuple([getValueKey(v) for v in value]))
+    return value
+
+
+def getMove(matrix1,matrix2):
+
+    """returns the distance between the origins of two placement matrices,
+    and True if their rotations differ. A missing placement counts as a rotation"""
+
+    if (matrix1 is None) or (matrix2 is None):
+        return 0.0,(matrix1 is None) != (matrix2 is None)
+    import numpy
+    distance = float(numpy.linalg.norm(matrix2[:3,3]-matrix1[:3,3]))
+    rotated = bool(numpy.abs(matrix2[:3,:3]-matrix1[:3,:3]).max() > ROTATION_TOLERANCE)
+    return distance,rotated
+
+
+def diffIfcFiles(mainfile,newfile,movetolerance=MOVE_TOLERANCE):
+
+    """compares the products of two IFC files, matched by GlobalId, and
+    returns an IfcDiffResult. What is compared: names, attributes, property
+    sets, geometry signatures, placements and materials"""
+
+    result = IfcDiffResult()
+    main = IfcDiffFile(mainfile)
+    new = IfcDiffFile(newfile)
+
+    for gid,product in new.products.items():
+        if not gid in main.products:
+            result.add("added",None,product)
+            continue
+        mainproduct = main.products[gid]
+        if product.Name != mainproduct.Name:
+            result.add("renamed",mainproduct,product,product.Name or "")
+        attributes = new.getAttributes(product)
+        mainattributes = main.getAttributes(mainproduct)
+        if attributes != mainattributes:
+            names = sorted(set(attributes) | set(mainattributes))
+            names = [n for n in names if attributes.get(n) != mainattributes.get(n)]
+            result.add("attributeschanged",mainproduct,product,", ".join(names))
+        changes = main.getPropertyTree(mainproduct).getChanges(new.getPropertyTree(product))
+        if changes:
+            result.add("propertieschanged",mainproduct,product,", ".join(changes))
+        distance,rotated = getMove(main.getPlacement(mainproduct),new.getPlacement(product))
+        if new.getSignature(product) != main.getSignature(mainproduct):
+            result.add("modified",mainproduct,product)
+        elif rotated or (distance >= movetolerance):
+            result.add("moved",mainproduct,product,distance)
+        elif new.getMaterials(product) != main.getMaterials(mainproduct):
+            result.add("materialchanged",mainproduct,product,", ".join(new.getMaterials(product)))
+        else:
+            result.unchanged.append((mainproduct,product))
+
+    for gid,product in main.products.items():
+        if not gid in new.products:
+            result.add("removed",product,None)
+
+    mainmaterials = main.getMaterialNames()
+    for material in new.ifc.by_type("IfcMaterial"):
+        if not material.Name in mainmaterials:
+            mainmaterials.add(material.Name)
+            result.add("newmaterials",None,material,material.Name)
+
+    return result
+
+
+def main(argv=None):
+
+    "the command line entry point"
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Shows the differences between two IFC files")
+    parser.add_argument("main",help="the main, older IFC file")
+    parser.add_argument("new",help="the newer IFC file")
+    parser.add_argument("-o","--output",help="the JSON or CSV file to write. Default is JSON on the standard output")
+    parser.add_argument("-t","--tolerance",type=float,default=MOVE_TOLERANCE,help="the max allowed move in mm")
+    args = parser.parse_args(argv)
+    result = diffIfcFiles(args.main,args.new,args.tolerance)
+    if args.output:
+        result.write(args.output)
+    else:
+        json.dump(result.toDict(),sys.stdout,indent=1,default=str)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,6 +26,9 @@ import os
 import FreeCAD
 from BimTranslateUtils import *
 
+MAX_SEARCH_RESULTS = 500 # the max number of search results displayed
+MIN_LOD_TRIANGLES = 12 # products are never decimated below this number of triangles
+
 
 class BIM_IfcExplorer:
 
@@ -70,11 +73,21 @@ class BIM_IfcExplorer:
         self.tree = QtGui.QTreeWidget()
         self.tree.setColumnCount(1)
         self.tree.setWordWrap(True)
+        self.tree.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
         self.tree.header().setDefaultSectionSize(60)
         self.tree.header().resizeSection(0,180)
         self.tree.header().setStretchLastSection(True)
         self.tree.headerItem().setText(0, translate("BIM","Objects structure"))
 
+        # draw the search widgets
+        self.search = QtGui.QLineEdit()
+        self.search.setPlaceholderText(translate("BIM","Search..."))
+        self.search.setToolTip(translate("BIM","Searches entities by type, name, GlobalId, tag or property value. #number finds an entity by its id"))
+        self.results = QtGui.QListWidget()
+        self.results.hide()
+        self.searchtimer = QtCore.QTimer()
+        self.searchtimer.setSingleShot(True)
+
         # draw the attributes widget
         self.attributes = QtGui.QTreeWidget()
         self.attributes.setColumnCount(2)
@@ -107,7 +120,11 @@ class BIM_IfcExplorer:
         layout = QtGui.QVBoxLayout(self.dialog)
         layout.addWidget(toolbar)
         hlayout = QtGui.QHBoxLayout(self.dialog)
-        hlayout.addWidget(self.tree)
+        tlayout = QtGui.QVBoxLayout(self.dialog)
+        tlayout.addWidget(self.search)
+        tlayout.addWidget(self.results)
+        tlayout.addWidget(self.tree)
+        hlayout.addLayout(tlayout)
         layout.addLayout(hlayout)
         vlayout = QtGui.QVBoxLayout(self.dialog)
         hlayout.addLayout(vlayout)
@@ -128,12 +145,19 @@ class BIM_IfcExplorer:
         toolbar.addAction(self.backAction)
 
         self.shapeAction = QtGui.QAction(translate("BIM","Insert"), None)
-        self.shapeAction.setToolTip(translate("BIM","Inserts the selected object and its children in the active document"))
+        self.shapeAction.setToolTip(translate("BIM","Inserts the selected objects and their children in the active document"))
         self.shapeAction.triggered.connect(self.insert)
         self.shapeAction.setIcon(QtGui.QIcon(":icons/Tree_Part.svg"))
         self.shapeAction.setEnabled(False)
         toolbar.addAction(self.shapeAction)
 
+        self.exportAction = QtGui.QAction(translate("BIM","Export"), None)
+        self.exportAction.setToolTip(translate("BIM","Exports the selected object and its children to a new IFC file"))
+        self.exportAction.triggered.connect(self.export)
+        self.exportAction.setIcon(QtGui.QIcon(":/icons/document-save-as.svg"))
+        self.exportAction.setEnabled(False)
+        toolbar.addAction(self.exportAction)
+
         self.meshAction = QtGui.QAction(translate("BIM","Mesh"), None)
         self.meshAction.setToolTip(translate("BIM","Turn mesh display on/off"))
         self.meshAction.triggered.connect(self.toggleMesh)
@@ -142,10 +166,51 @@ class BIM_IfcExplorer:
         self.meshAction.setIcon(QtGui.QIcon(":/icons/DrawStyleShaded.svg"))
         toolbar.addAction(self.meshAction)
 
+        self.profileAction = QtGui.QAction(translate("BIM","Profile"), None)
+        self.profileAction.setToolTip(translate("BIM","Tessellate all the products again, and report the cost of each"))
+        self.profileAction.triggered.connect(self.profileMesh)
+        self.profileAction.setIcon(QtGui.QApplication.style().standardIcon(QtGui.QStyle.SP_FileDialogDetailedView))
+        toolbar.addAction(self.profileAction)
+
+        self.stopAction = QtGui.QAction(translate("BIM","Stop"), None)
+        self.stopAction.setToolTip(translate("BIM","Stop loading the file or the mesh"))
+        self.stopAction.triggered.connect(self.stop)
+        self.stopAction.setIcon(QtGui.QApplication.style().standardIcon(QtGui.QStyle.SP_BrowserStop))
+        self.stopAction.setEnabled(False)
+        toolbar.addAction(self.stopAction)
+
+        self.progressbar = QtGui.QProgressBar()
+        self.progressbar.setMaximumWidth(200)
+        self.progressAction = toolbar.addWidget(self.progressbar)
+        self.progressAction.setVisible(False)
+
+        # the timer that collects the meshes computed in the background
+        self.meshtimer = QtCore.QTimer()
+        self.meshtimer.timeout.connect(self.updateMesh)
+        self.meshthread = None
+
+        # the timer that collects the results of the thread that loads the file
+        self.loadtimer = QtCore.QTimer()
+        self.loadtimer.timeout.connect(self.updateLoad)
+        self.loadthread = None
+        self.loadqueue = None
+        self.filename = None
+        self.stepindex = None
+
+        # the contents of the loaded file, see clearFile
+        self.ifc = None
+        self.lowmemory = False
+        self.clearFile()
+
         # connect signals/slots
         self.tree.currentItemChanged.connect(self.onSelectTree)
+        self.tree.itemSelectionChanged.connect(self.onSelectionChanged)
+        self.tree.itemExpanded.connect(self.onExpandTree)
         self.attributes.itemDoubleClicked.connect(self.onDoubleClickTree)
         self.properties.itemDoubleClicked.connect(self.onDoubleClickTree)
+        self.search.textChanged.connect(self.onSearchChanged)
+        self.searchtimer.timeout.connect(self.doSearch)
+        self.results.itemClicked.connect(self.onClickResult)
         self.dialog.rejected.connect(self.close)
 
         # center the dialog over FreeCAD window
@@ -159,49 +224,305 @@ class BIM_IfcExplorer:
 
     def open(self):
         
-        "opens a file"
+        "opens a file, scanned, read and indexed in a worker thread"
         
-        import ifcopenshell
         from PySide import QtCore,QtGui
-        self.filename = None
         lastfolder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcExplorerFolder","")
         filename = QtGui.QFileDialog.getOpenFileName(None,translate("BIM","Select an IFC file"),lastfolder,translate("BIM","IFC files (*.ifc)"))
-        if filename:
-            self.filename = filename[0]
-            FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetString("lastIfcExplorerFolder",os.path.dirname(self.filename))
+        if not (filename and filename[0]):
+            # the current file, if any, stays loaded
+            return
+        filename = filename[0]
+        FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetString("lastIfcExplorerFolder",os.path.dirname(filename))
 
-        if not os.path.exists(self.filename):
+        if not os.path.exists(filename):
             FreeCAD.Console.PrintError(translate("BIM","File not found")+"\n")
             return
-        
+
+        # scan the file without parsing it first, see onFileScanned
+        self.stopLoad()
+        self.startLoad(self.scanFile,translate("BIM","Scanning file..."),filename)
+
+
+    def startLoad(self,target,text,*args):
+
+        "runs target(results,cancel,*args) in a worker thread that puts (stage,value) tuples in results"
+
+        import threading
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        self.loadqueue = queue.Queue()
+        self.loadcancel = threading.Event()
+        self.loadthread = threading.Thread(target=self.runLoad,args=(target,self.loadqueue,self.loadcancel)+args)
+        self.loadthread.daemon = True
+        self.progressbar.setMaximum(3)
+        self.progressbar.setValue(0)
+        self.progressbar.setFormat(text)
+        self.progressAction.setVisible(True)
+        self.stopAction.setEnabled(True)
+        self.loadthread.start()
+        self.loadtimer.start(100)
+
+
+    def runLoad(self,target,results,cancel,*args):
+
+        "runs a loading stage and reports its errors. Runs in the worker thread"
+
+        try:
+            target(results,cancel,*args)
+        except Exception as e:
+            results.put(("error",str(e)))
+        finally:
+            results.put(None)
+
+
+    def scanFile(self,results,cancel,filename):
+
+        "scans the given file. Runs in the worker thread"
+
+        import BimIfcStepScan
+        results.put(("scanned",BimIfcStepScan.StepIndex(filename)))
+
+
+    def readFile(self,results,cancel,stepindex,lowmemory,memorylimit):
+
+        "reads and indexes the scanned file. Runs in the worker thread"
+
+        import ifcopenshell
+        import BimIfcIndex
+        import BimIfcStepScan
+        if lowmemory:
+            ifcfile = BimIfcStepScan.StepFile(stepindex,memorylimit//2)
+        else:
+            ifcfile = ifcopenshell.open(stepindex.filename)
+        if cancel.is_set():
+            return
+        results.put(("read",ifcfile))
+        # the tessellation cache finds the file by its hash, which would freeze the GUI
+        import BimIfcTessellation
+        results.put(("hashed",BimIfcTessellation.getFileHash(stepindex.filename)))
+        if cancel.is_set():
+            return
+        index = BimIfcIndex.IfcRelationIndex(ifcfile)
+        psetindex = BimIfcIndex.IfcPropertyIndex(ifcfile)
+        if cancel.is_set():
+            return
+        results.put(("indexed",(index,psetindex)))
+        # in low memory mode, the search index gets a quarter of the memory limit
+        searchindex = BimIfcIndex.IfcSearchIndex(ifcfile,memorylimit//4 if lowmemory else None)
+        if cancel.is_set():
+            return
+        results.put(("searchable",searchindex))
+
+
+    def updateLoad(self):
+
+        "collects the results of the worker thread that loads the file"
+
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        results = self.loadqueue
+        while results and (results is self.loadqueue):
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                break
+            if result is None:
+                self.finishLoad()
+            elif result[0] == "error":
+                FreeCAD.Console.PrintError(translate("BIM","Error loading file")+": "+result[1]+"\n")
+            elif result[0] == "scanned":
+                self.onFileScanned(result[1])
+            elif result[0] == "read":
+                self.onFileRead(result[1])
+            elif result[0] == "hashed":
+                self.filehash = result[1]
+            elif result[0] == "indexed":
+                self.onFileIndexed(*result[1])
+            elif result[0] == "searchable":
+                self.onFileSearchable(result[1])
+
+
+    def onFileScanned(self,stepindex):
+
+        "asks before loading large files, clears everything and starts reading the file"
+
+        from PySide import QtCore,QtGui
+        # the timer must not run while the dialog below is open
+        self.loadtimer.stop()
+        FreeCAD.Console.PrintMessage(self.getFileStats(stepindex)+"\n")
+        p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM")
+        memorylimit = p.GetInt("IfcExplorerMemoryLimit",1024)*1024*1024 # in Mb
+        lowmemory = False
+        if stepindex.size > p.GetInt("IfcExplorerLargeFileSize",100)*1024*1024: # in Mb
+            box = QtGui.QMessageBox(QtGui.QMessageBox.Question,
+                                    translate("BIM","Large IFC file"),
+                                    self.getFileStats(stepindex)+"\n\n"+translate("BIM","This file is large and might take a long time to load. Load it? In low memory mode, entities are only read from the file when needed, and the mesh can only be displayed if it was computed before."))
+            box.addButton(QtGui.QMessageBox.Yes)
+            lowmemorybutton = box.addButton(translate("BIM","Low memory mode"),QtGui.QMessageBox.AcceptRole)
+            box.addButton(QtGui.QMessageBox.No)
+            box.setDefaultButton(QtGui.QMessageBox.Yes)
+            reply = box.exec_()
+            if box.clickedButton() == lowmemorybutton:
+                lowmemory = True
+            elif reply != QtGui.QMessageBox.Yes:
+                # the current file, if any, stays loaded
+                self.finishLoad()
+                return
+        self.stepindex = stepindex
+        self.filename = stepindex.filename
+
         # set window title
         self.dialog.setWindowTitle(translate("BIM","IFC Explorer")+" - "+os.path.basename(self.filename))
 
         # clear everything
+        self.clearFile(lowmemory,memorylimit)
+        self.startLoad(self.readFile,translate("BIM","Reading file..."),self.stepindex,self.lowmemory,self.memorylimit)
+        self.progressbar.setValue(1)
+
+
+    def clearFile(self,lowmemory=False,memorylimit=0):
+
+        "clears the tree, the indexes and the meshes of the current file"
+
+        self.stopMesh(discard=True)
+        if self.lowmemory and self.ifc:
+            self.ifc.close()
+        self.ifc = None
+        self.filehash = None
+        self.index = None
+        self.lowmemory = lowmemory
+        self.memorylimit = memorylimit
         self.tree.clear()
         self.attributes.clear()
         self.properties.clear()
-        self.done = []
+        self.items = {} # entity id: tree item, for all the items created so far
+        self.searchindex = None
+        self.psetindex = None
+        self.results.clear()
+        self.results.hide()
         self.backnav = []
         self.mesh = None
+        self.meshparts = []
+        self.meshbatches = []
+        self.meshcomplete = False
         self.products = []
         self.omeshes = {}
+        self.meshkeys = {} # low memory mode: product id: tessellation cache key
+        self.meshcache = None
+        self.resetSubtreeCaches()
         self.currentmesh = None
 
-        # read file and order contents
-        self.ifc = ifcopenshell.open(self.filename)
-        root = self.getEntitiesTree()
+        # the tools that need the index are enabled when it is ready, see onFileIndexed
+        self.search.setEnabled(False)
+        self.meshAction.setEnabled(False)
+        self.profileAction.setEnabled(False)
+
 
-        # populate tree contents
-        for eid,children in root.items():
-            self.addEntity(eid,children,self.tree)
-        #self.tree.expandAll()
+    def onFileRead(self,ifcfile):
+
+        "adds the root entities to the tree, their children are added on expand"
+
+        self.ifc = ifcfile
+        self.progressbar.setValue(2)
+        self.progressbar.setFormat(translate("BIM","Indexing file..."))
+        for site in self.ifc.by_type("IfcSite"):
+            self.addEntity(site.id(),self.tree)
+
+
+    def onFileIndexed(self,index,psetindex):
+
+        "enables the tree expansion and the tools that need the indexes"
+
+        from PySide import QtCore
+        self.index = index
+        self.psetindex = psetindex
+        self.progressbar.setValue(3)
+        self.progressbar.setFormat(translate("BIM","Building search index..."))
+        self.meshAction.setEnabled(True)
+        self.profileAction.setEnabled(not self.lowmemory)
+        self.search.setEnabled(True)
+        # populate the items expanded before the index was ready
+        for item in list(self.items.values()):
+            if item.isExpanded() and not item.data(0,QtCore.Qt.UserRole+1):
+                self.onExpandTree(item)
+        # show the properties of the item selected before the index was ready
+        item = self.tree.currentItem()
+        if item:
+            self.properties.clear()
+            self.addProperties(item.data(0,QtCore.Qt.UserRole),self.properties)
+            self.properties.expandAll()
+
+
+    def onFileSearchable(self,searchindex):
+
+        "runs the pending search, warning if the search index had to be cut"
+
+        self.searchindex = searchindex
+        if not searchindex.complete:
+            FreeCAD.Console.PrintWarning(translate("BIM","Low memory mode: the search index reached the memory limit, some names and property values can't be searched")+"\n")
+        if self.search.text().strip():
+            self.doSearch()
+
+
+    def finishLoad(self):
+
+        "hides the progress bar when the worker thread that loads the file is done"
+
+        self.loadtimer.stop()
+        self.loadthread = None
+        self.progressAction.setVisible(False)
+        self.stopAction.setEnabled(False)
+
+
+    def stopLoad(self):
+
+        "stops loading the file. The worker thread can't be interrupted, its results are discarded"
+
+        if self.loadthread:
+            self.loadcancel.set()
+            self.loadqueue = None
+            self.finishLoad()
+
+
+    def stop(self):
+
+        "stops loading the file or the mesh"
+
+        if self.loadthread:
+            self.stopLoad()
+        else:
+            self.stopMesh()
+
+
+    def getFileStats(self,stepindex):
+
+        "returns a text describing the contents of the given BimIfcStepScan.StepIndex"
+
+        text = os.path.basename(stepindex.filename)+"\n"
+        text += translate("BIM","Size")+": "+"%.1f" % (stepindex.size/1048576.0)+" Mb\n"
+        text += translate("BIM","Schema")+": "+stepindex.schema+"\n"
+        text += translate("BIM","Entities")+": "+self.tostr(stepindex.getCount())+"\n"
+        text += translate("BIM","Most used types")+":"
+        types = sorted(stepindex.types.items(),key=lambda t: t[1],reverse=True)
+        for name,count in types[:10]:
+            text += "\n    "+name+": "+self.tostr(count)
+        return text
 
 
     def close(self):
         
         "close the dialog"
         
+        self.stopLoad()
+        self.stopMesh(discard=True)
+        if self.lowmemory and self.ifc:
+            self.ifc.close()
+            self.lowmemory = False
         if FreeCAD.ActiveDocument:
             if self.mesh:
                 FreeCAD.ActiveDocument.removeObject(self.mesh.Name)
@@ -220,33 +541,80 @@ class BIM_IfcExplorer:
 
     def insert(self):
         
-        "inserts selected objects in the active document"
+        "inserts the selected objects in the active document, in one import pass"
         
         import importIFC
-        from PySide import QtCore,QtGui
         doc = FreeCAD.ActiveDocument
         if doc and self.filename:
-            item = self.tree.currentItem()
-            if item:
-                eid = item.data(0,QtCore.Qt.UserRole)
-                if eid:
-                    importIFC.ZOOMOUT = False
+            eids = self.getSelectedIds()
+            if eids:
+                importIFC.ZOOMOUT = False
+                options = {"only":eids}
+                try:
+                    import importIFCHelper
+                    options["preferences"] = importIFCHelper.getPreferences()
+                    # place shared representation maps as clones of a single object
+                    options["preferences"]["CREATE_CLONES"] = True
+                except (ImportError,AttributeError):
+                    pass
+                if self.lowmemory:
+                    importIFC.insert(self.filename,doc.Name,**options)
+                else:
                     try:
-                        importIFC.insert(self.ifc,doc.Name,only=[eid])
+                        importIFC.insert(self.ifc,doc.Name,**options)
                     except TypeError:
-                        importIFC.insert(self.filename,doc.Name,only=[eid])
-                    if self.currentmesh:
-                        self.currentmesh.ViewObject.hide()
+                        importIFC.insert(self.filename,doc.Name,**options)
+                if self.currentmesh:
+                    self.currentmesh.ViewObject.hide()
+
+
+    def getSelectedIds(self):
+
+        "returns the ids of the selected products that have no selected parent"
+
+        from PySide import QtCore
+        eids = []
+        if not self.index:
+            return eids
+        for item in self.tree.selectedItems():
+            eid = item.data(0,QtCore.Qt.UserRole)
+            if eid and (not eid in eids) and self.ifc[eid].is_a("IfcProduct"):
+                eids.append(eid)
+        selected = set(eids)
+        return [eid for eid in eids if not selected.intersection(self.index.getAncestors(eid))]
+
+
+    def export(self):
+
+        "exports the selected object and its children to a standalone IFC file"
+
+        import BimIfcSubset
+        from PySide import QtCore,QtGui
+        item = self.tree.currentItem()
+        if not (item and self.filename):
+            return
+        eid = item.data(0,QtCore.Qt.UserRole)
+        if not eid:
+            return
+        lastfolder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcExplorerFolder","")
+        filename = QtGui.QFileDialog.getSaveFileName(None,translate("BIM","Export to IFC file"),lastfolder,translate("BIM","IFC files (*.ifc)"))
+        if filename and filename[0]:
+            filename = filename[0]
+            if not filename.lower().endswith(".ifc"):
+                filename += ".ifc"
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try:
+                subset = BimIfcSubset.IfcSubset(self.ifc,self.index,self.stepindex,eid)
+                count = subset.write(filename)
+            finally:
+                QtGui.QApplication.restoreOverrideCursor()
+            FreeCAD.Console.PrintMessage(translate("BIM","Exported")+" "+str(count)+" "+translate("BIM","entities to")+" "+filename+"\n")
 
 
     def toggleMesh(self,checked=False):
         
         "turns mesh display on/off"
 
-        import FreeCADGui
-        import Mesh
-        import ifcopenshell
-        from ifcopenshell import geom
         if not FreeCAD.ActiveDocument:
             doc = FreeCAD.newDocument()
             FreeCAD.setActiveDocument(doc.Name)
@@ -254,112 +622,304 @@ class BIM_IfcExplorer:
             if checked:
                 if self.mesh:
                     self.mesh.ViewObject.show()
-                else:
-                    try:
-                        import importIFCHelper
-                        s = importIFCHelper.getScaling(self.ifc)
-                    except:
-                        import importIFC
-                        s = importIFC.getScaling(self.ifc)
-                    s *= 1000 # ifcopenshell outputs its meshes in metres
-                    trf = None
-                    if s != 1:
-                        trf = FreeCAD.Matrix()
-                        trf.scale(s,s,s)
-                    basemesh = Mesh.Mesh()
-                    s = geom.settings()
-                    s.set(s.USE_WORLD_COORDS,True)
-                    for product in self.products:
-                        try:
-                            m = geom.create_shape(s,product)
-                            g = m.geometry
-                            v = g.verts
-                            f = g.faces
-                            verts = [FreeCAD.Vector(v[i:i+3]) for i in range(0,len(v),3)]
-                            faces = [tuple(f[i:i+3]) for i in range(0,len(f),3)]
-                            omesh = Mesh.Mesh((verts,faces))
-                            if trf:
-                                omesh.transform(trf)
-                            self.omeshes[product.id()] = omesh
-                            basemesh.addMesh(omesh)
-                        except:
-                            pass
-                    self.mesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature","IFCMesh")
-                    self.mesh.Mesh = basemesh
-                    self.mesh.ViewObject.Transparency = 85
-                    FreeCAD.ActiveDocument.recompute()
-                    FreeCADGui.Selection.clearSelection()
-                    FreeCADGui.Selection.addSelection(self.mesh)
-                    FreeCADGui.SendMsgToActiveView("ViewSelection")
+                if not self.meshcomplete:
+                    self.startMesh()
             else:
+                self.stopMesh()
                 if self.mesh:
                     self.mesh.ViewObject.hide()
                 if self.currentmesh:
                     self.currentmesh.ViewObject.hide()
 
 
-    def getEntitiesTree(self):
+    def profileMesh(self):
 
-        "stacks the entities inside containers"
+        "tessellates all the products again, recording and reporting the cost of each"
 
-        root = {}
+        if self.meshthread or self.lowmemory or (not self.index):
+            return
+        if not FreeCAD.ActiveDocument:
+            doc = FreeCAD.newDocument()
+            FreeCAD.setActiveDocument(doc.Name)
+        self.omeshes = {}
+        self.meshbatches = []
+        self.meshcomplete = False
+        self.resetSubtreeCaches()
+        self.meshAction.setChecked(True)
+        if self.mesh:
+            self.mesh.ViewObject.show()
+        self.startMesh(profile=True)
 
-        for site in self.ifc.by_type("IfcSite"):
-            root[site.id()] = self.getChildren(site)
-
-        return root
-
-        #entities =  ifc.by_type("IfcRoot")
-        #entities += ifc.by_type("IfcRepresentation")
-        #entities += ifc.by_type("IfcRepresentationItem")
-        #entities += ifc.by_type("IfcRepresentationMap")
-        #entities += ifc.by_type("IfcPlacement")
-        #entities += ifc.by_type("IfcProperty")
-        #entities += ifc.by_type("IfcPhysicalSimpleQuantity")
-        #entities += ifc.by_type("IfcMaterial")
-        #entities += ifc.by_type("IfcProductRepresentation")
-        #entities = sorted(entities, key=lambda eid: eid.id())
-
-
-    def getChildren(self,obj,keys=False):
-
-        "returns a recursive dict of the children of this obj"
-
-        children = {}
-        if obj.is_a("IfcProduct"):
-            self.products.append(obj)
-        if hasattr(obj,"IsDecomposedBy"): # building structure
-            for rel in obj.IsDecomposedBy:
-                if hasattr(rel,"RelatedObjects"):
-                    for child in rel.RelatedObjects:
-                        children[child.id()] = self.getChildren(child)
-        if hasattr(obj,"ContainsElements"): # objects inside building structure
-            for rel in obj.ContainsElements:
-                if hasattr(rel,"RelatedElements"):
-                    for child in rel.RelatedElements:
-                        children[child.id()] = self.getChildren(child)
-        if hasattr(obj,"Representation"): # Shape representation
-            if obj.Representation:
-                children[obj.Representation.id()] = self.getChildren(obj.Representation)
-        if hasattr(obj,"Representations"):
-            for rep in obj.Representations:
-                children[rep.id()] = self.getChildren(rep)
-        if obj.is_a("IfcShapeRepresentation"):
-            for it in obj.Items:
-                children[it.id()] = self.getChildren(it)
-        if keys:
-            def getkeys(d): 
-                ck = list(d.keys())
-                for v in d.values():
-                    ck.extend(getkeys(v))
-                return ck
-            return getkeys(children)
-        return children
-
-
-    def addEntity(self,eid,children,parent):
-
-        "adds a given entity and its children to the given tree item"
+
+    def startMesh(self,profile=False):
+
+        "starts tessellating the products that have no mesh yet in a worker thread, profiling them if asked"
+
+        import threading
+        import BimIfcTessellation
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        if self.meshthread:
+            return
+        try:
+            import importIFCHelper
+            s = importIFCHelper.getScaling(self.ifc)
+        except:
+            import importIFC
+            s = importIFC.getScaling(self.ifc)
+        self.meshscale = s * 1000 # ifcopenshell outputs its meshes in metres
+        cache = self.getMeshCache()
+        if self.lowmemory:
+            # the file is not loaded, only meshes already in the cache can be shown
+            if cache and self.filehash:
+                self.meshkeys = cache.getManifest(self.filehash,BimIfcTessellation.getSettingsKey())
+            if self.meshkeys:
+                self.meshcache = cache
+                self.meshcomplete = True
+                FreeCAD.Console.PrintMessage(translate("BIM","Low memory mode: only the mesh of the selected entity is displayed")+"\n")
+            else:
+                FreeCAD.Console.PrintWarning(translate("BIM","Low memory mode: no mesh of this file was found in the cache. Open it once in normal mode to compute it.")+"\n")
+                self.meshAction.setChecked(False)
+            return
+        if not self.products:
+            self.products = self.getProducts()
+        products = [product for product in self.products if not product.id() in self.omeshes]
+        p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM")
+        self.tessellator = BimIfcTessellation.IfcTessellator(self.ifc,p.GetInt("IfcExplorerThreads",0),cache,self.filehash,profile)
+        self.meshdoc = FreeCAD.ActiveDocument
+        self.meshqueue = queue.Queue()
+        self.meshcancel = threading.Event()
+        self.meshpending = []
+        self.meshbatchsize = max(500,len(products)//20)
+        # the overview mesh is decimated to fit in a triangle budget, shared
+        # evenly between the products. 0 disables decimation
+        budget = p.GetInt("IfcExplorerTriangleBudget",1000000)
+        self.meshlodsize = 0
+        if budget:
+            self.meshlodsize = max(MIN_LOD_TRIANGLES,budget//max(1,len(self.products)))
+        self.progressbar.setMaximum(len(products))
+        self.progressbar.setValue(0)
+        self.progressbar.setFormat("%p%")
+        self.progressAction.setVisible(True)
+        self.stopAction.setEnabled(True)
+        self.meshthread = threading.Thread(target=self.runMesh,args=(products,self.tessellator,self.meshqueue,self.meshcancel,self.meshlodsize))
+        self.meshthread.daemon = True
+        self.meshthread.start()
+        self.meshtimer.start(100)
+
+
+    def getMeshCache(self):
+
+        "returns the tessellation cache, or None if it is disabled"
+
+        import BimIfcTessellation
+        cachesize = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetInt("IfcExplorerCacheSize",1024) # in Mb, 0 disables the cache
+        if cachesize:
+            cachepath = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","IfcExplorerCache")
+            return BimIfcTessellation.IfcTessellationCache(cachepath,cachesize*1024*1024)
+        return None
+
+
+    def runMesh(self,products,tessellator,results,cancel,lodsize):
+
+        "tessellates the given products into the given queue. Runs in the worker thread, using only its arguments"
+
+        import BimIfcTessellation
+        tessellation = tessellator.tessellate(products)
+        try:
+            for eid,verts,faces in tessellation:
+                if cancel.is_set():
+                    break
+                lodverts,lodfaces = verts,faces
+                if lodsize:
+                    lodverts,lodfaces = BimIfcTessellation.decimateArrays(verts,faces,lodsize)
+                results.put((eid,verts,faces,lodverts,lodfaces))
+        finally:
+            tessellation.close() # stores what has been done so far in the cache
+            results.put(None)
+
+
+    def updateMesh(self):
+
+        "collects the meshes computed by the worker thread and adds them to the document in batches"
+
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        finished = False
+        while True:
+            try:
+                result = self.meshqueue.get_nowait()
+            except queue.Empty:
+                break
+            if result is None:
+                finished = True
+                break
+            self.meshpending.append(result)
+            self.progressbar.setValue(self.progressbar.value()+1)
+        if self.meshpending and (finished or (len(self.meshpending) >= self.meshbatchsize)):
+            self.addMeshBatch()
+        if finished:
+            self.finishMesh()
+
+
+    def addMeshBatch(self):
+
+        "displays the decimated pending meshes as a temporary mesh object, keeping the full ones for highlighting"
+
+        import FreeCADGui
+        import BimIfcTessellation
+        # scale all vertices of the batch at once, then keep a view on
+        # the scaled vertices of each product, for highlighting
+        verts,faces = BimIfcTessellation.mergeArrays([(v,f) for eid,v,f,lv,lf in self.meshpending])
+        verts *= self.meshscale
+        start = 0
+        for eid,v,f,lv,lf in self.meshpending:
+            self.omeshes[eid] = (verts[start:start+len(v)],f)
+            start += len(v)
+        if self.meshlodsize:
+            verts,faces = BimIfcTessellation.mergeArrays([(lv,lf) for eid,v,f,lv,lf in self.meshpending])
+            verts *= self.meshscale
+        self.meshpending = []
+        self.resetSubtreeCaches()
+        self.meshbatches.append((verts,faces))
+        part = self.meshdoc.addObject("Mesh::Feature","IFCMeshPart")
+        part.Mesh = BimIfcTessellation.makeMesh(verts,faces)
+        part.ViewObject.Transparency = 85
+        self.meshparts.append(part)
+        self.meshdoc.recompute()
+        if (len(self.meshparts) == 1) and (not self.mesh):
+            FreeCADGui.SendMsgToActiveView("ViewFit")
+
+
+    def finishMesh(self):
+
+        "replaces the temporary mesh objects by a single one when the worker thread is done"
+
+        import FreeCADGui
+        import BimIfcTessellation
+        self.meshtimer.stop()
+        self.meshthread = None
+        self.progressAction.setVisible(False)
+        self.stopAction.setEnabled(False)
+        self.meshcomplete = not self.meshcancel.is_set()
+        for part in self.meshparts:
+            self.meshdoc.removeObject(part.Name)
+        self.meshparts = []
+        if self.meshbatches:
+            self.meshbatches = [BimIfcTessellation.mergeArrays(self.meshbatches)]
+            if not self.mesh:
+                self.mesh = self.meshdoc.addObject("Mesh::Feature","IFCMesh")
+                self.mesh.ViewObject.Transparency = 85
+            self.mesh.Mesh = BimIfcTessellation.makeMesh(*self.meshbatches[0])
+            self.meshdoc.recompute()
+            if not self.meshAction.isChecked():
+                self.mesh.ViewObject.hide()
+            elif self.meshcomplete:
+                FreeCADGui.Selection.clearSelection()
+                FreeCADGui.Selection.addSelection(self.mesh)
+                FreeCADGui.SendMsgToActiveView("ViewSelection")
+        if self.tessellator.failures:
+            FreeCAD.Console.PrintWarning(str(len(self.tessellator.failures))+" "+translate("BIM","products could not be tessellated")+":\n")
+            for eid,message in self.tessellator.failures.items():
+                FreeCAD.Console.PrintWarning("#"+self.tostr(eid)+" : "+self.tostr(self.ifc[eid].is_a())+" : "+message+"\n")
+        if self.tessellator.profile:
+            self.showProfile()
+
+
+    def showProfile(self):
+
+        "shows the cost of each tessellated product in a sortable table"
+
+        from PySide import QtCore,QtGui
+        rows = self.tessellator.getProfileRows()
+        dialog = QtGui.QDialog(self.dialog)
+        dialog.setWindowTitle(translate("BIM","Heaviest elements"))
+        dialog.resize(720,480)
+        layout = QtGui.QVBoxLayout(dialog)
+        total = sum([row[3] for row in rows])
+        label = QtGui.QLabel(self.tostr(len(rows))+" "+translate("BIM","products tessellated in")+" "+"%.2f" % total+" s. "+translate("BIM","Double-click a row to select it in the tree"))
+        layout.addWidget(label)
+        table = QtGui.QTreeWidget()
+        table.setRootIsDecorated(False)
+        table.setHeaderLabels([translate("BIM","Id"),translate("BIM","Type"),translate("BIM","Name"),translate("BIM","Time (ms)"),translate("BIM","Triangles"),translate("BIM","Vertices"),translate("BIM","Representation")])
+        for eid,typename,name,seconds,triangles,vertices,representation in rows:
+            item = QtGui.QTreeWidgetItem(table)
+            # numbers are stored as numbers so they sort as such
+            item.setData(0,QtCore.Qt.DisplayRole,eid)
+            item.setText(1,self.tostr(typename))
+            item.setText(2,self.tostr(name))
+            item.setData(3,QtCore.Qt.DisplayRole,round(seconds*1000,2))
+            item.setData(4,QtCore.Qt.DisplayRole,triangles)
+            item.setData(5,QtCore.Qt.DisplayRole,vertices)
+            item.setText(6,self.tostr(representation))
+        table.setSortingEnabled(True)
+        table.sortByColumn(3,QtCore.Qt.DescendingOrder)
+        table.itemDoubleClicked.connect(lambda item,column: self.selectEntity(item.data(0,QtCore.Qt.DisplayRole)))
+        layout.addWidget(table)
+        buttons = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Close)
+        exportButton = buttons.addButton(translate("BIM","Export CSV..."),QtGui.QDialogButtonBox.ActionRole)
+        exportButton.clicked.connect(self.exportProfile)
+        buttons.rejected.connect(dialog.close)
+        layout.addWidget(buttons)
+        dialog.show()
+        self.profiledialog = dialog
+
+
+    def exportProfile(self):
+
+        "saves the last tessellation profile to a CSV file"
+
+        from PySide import QtGui
+        lastfolder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcExplorerFolder","")
+        filename = QtGui.QFileDialog.getSaveFileName(None,translate("BIM","Export profile"),lastfolder,translate("BIM","CSV files (*.csv)"))
+        if filename and filename[0]:
+            filename = filename[0]
+            if not filename.lower().endswith(".csv"):
+                filename += ".csv"
+            self.tessellator.writeProfile(filename)
+            FreeCAD.Console.PrintMessage(translate("BIM","Profile saved to")+" "+filename+"\n")
+
+
+    def stopMesh(self,discard=False):
+
+        "stops the mesh worker thread, keeping what has been computed so far unless discard is True"
+
+        if self.meshthread:
+            self.meshcancel.set()
+            if discard:
+                self.meshtimer.stop()
+                self.meshthread = None
+                self.progressAction.setVisible(False)
+                self.stopAction.setEnabled(False)
+                for part in self.meshparts:
+                    if part.Document:
+                        part.Document.removeObject(part.Name)
+                self.meshparts = []
+
+
+    def getProducts(self):
+
+        "returns all the products found in the spatial structure of the file"
+
+        import BimIfcExplorerCore
+        return BimIfcExplorerCore.getProducts(self.ifc,self.index)
+
+
+    def getChildren(self,obj):
+
+        "returns a list of the direct children of this obj"
+
+        import BimIfcExplorerCore
+        return BimIfcExplorerCore.getChildren(self.ifc,self.index,obj)
+
+
+    def addEntity(self,eid,parent):
+
+        "adds a given entity to the given tree item. Children are added on expand"
 
         from PySide import QtCore,QtGui
 
@@ -369,7 +929,7 @@ class BIM_IfcExplorer:
             except:
                 return ""
 
-        if not eid in self.done:
+        if not eid in self.items:
             entity = self.ifc[eid]
             item = QtGui.QTreeWidgetItem(parent)
             #item.setText(0,self.tostr(eid))
@@ -377,8 +937,6 @@ class BIM_IfcExplorer:
             if entity.is_a("IfcProduct"):
                 name = get_name(entity)
                 item.setFont(0,self.bold)
-                if isinstance(parent,QtGui.QTreeWidgetItem):
-                    parent.setExpanded(True)
             item.setText(0,"#"+self.tostr(eid)+" : "+self.tostr(entity.is_a())+name)
             if entity.is_a() in ["IfcWall","IfcWallStandardCase"]:
                 item.setIcon(0,QtGui.QIcon(":icons/Arch_Wall_Tree.svg"))
@@ -412,101 +970,86 @@ class BIM_IfcExplorer:
                 item.setIcon(0,QtGui.QIcon(":icons/Arch_Component.svg"))
             self.tree.setFirstItemColumnSpanned(item,True)
             item.setData(0,QtCore.Qt.UserRole,eid)
-            for childid,grandchildren in children.items():
-                self.addEntity(childid,grandchildren,item)
-            self.done.append(eid)
+            if entity.is_a("IfcObjectDefinition") or entity.is_a("IfcProductRepresentation") or entity.is_a("IfcShapeRepresentation"):
+                # this entity might have children, they will be looked for when expanded
+                item.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.ShowIndicator)
+            self.items[eid] = item
+            if entity.is_a() in ["IfcSite","IfcBuilding"]:
+                # expand the upper levels of the spatial structure
+                item.setExpanded(True)
 
 
     def addAttributes(self,eid,parent):
 
         "adds the attributes of the given IFC entity under the given QTreeWidgetITem"
 
-        import ifcopenshell
+        import BimIfcIndex
         from PySide import QtCore,QtGui
         
         entity = self.ifc[eid]
 
-        i = 0
-        while True:
+        for attribute in BimIfcIndex.getAttributeDeclarations(self.ifc,entity):
+            if attribute.name in ["Id", "GlobalId"]:
+                continue
             try:
-                argname = entity.attribute_name(i)
-            except RuntimeError:
+                argvalue = getattr(entity,attribute.name)
+            except AttributeError:
+                FreeCAD.Console.PrintError(translate("BIM","Error in entity")+" "+self.tostr(entity)+"\n")
                 break
+            item = QtGui.QTreeWidgetItem(parent)
+            item.setText(0,self.tostr(attribute.name))
+            if attribute.typename:
+                item.setToolTip(0,attribute.typename)
+            if argvalue is None:
+                continue
+            if attribute.reference == "select":
+                # the declaration doesn't tell, look at the value
+                aggregate = isinstance(argvalue,(list,tuple))
             else:
-                try:
-                    argvalue = getattr(entity,argname)
-                except AttributeError:
-                    FreeCAD.Console.PrintError(translate("BIM","Error in entity")+" "+self.tostr(entity)+"\n")
-                    break
-                else:
-                    if argname not in ["Id", "GlobalId"]:
-                        colored = False
-                        if isinstance(argvalue,ifcopenshell.entity_instance):
-                            if argvalue.id() == 0:
-                                t = self.tostr(argvalue)
-                            else:
-                                colored = True
-                                t = "#" + self.tostr(argvalue.id()) + ": " + self.tostr(argvalue.is_a())
-                        elif isinstance(argvalue,(list,tuple)):
-                            t = ""
-                        else:
-                            t = self.tostr(argvalue)
-                        item = QtGui.QTreeWidgetItem(parent)
-                        item.setText(0,self.tostr(argname))
-                        if t and (t != "None"):
-                            item.setText(1,t)
-                            if colored:
-                                item.setForeground(1,self.linkbrush)
-                                item.setFont(1,self.linkfont)
-                            if argname == "Name":
-                                item.setFont(1,self.bold)
-                        if isinstance(argvalue,(list,tuple)):
-                            j = 0
-                            for argitem in argvalue:
-                                colored = False
-                                if isinstance(argitem,ifcopenshell.entity_instance):
-                                    if argitem.id() == 0:
-                                        t = self.tostr(argitem)
-                                    else:
-                                        colored = True
-                                        t = "#" + self.tostr(argitem.id()) + ": " + self.tostr(argitem.is_a())
-                                else:
-                                    t = argitem
-                                t = self.tostr(t)
-                                if j == 0:
-                                    item.setText(1,t)
-                                    if colored:
-                                        item.setForeground(1,self.linkbrush)
-                                        item.setFont(1,self.linkfont)
-                                else:
-                                    subitem = QtGui.QTreeWidgetItem(item)
-                                    subitem.setText(1,t)
-                                    if colored:
-                                        subitem.setForeground(1,self.linkbrush)
-                                        subitem.setFont(1,self.linkfont)
-                                j += 1
-                i += 1
+                aggregate = attribute.aggregate
+            if not aggregate:
+                self.setAttributeText(item,argvalue,attribute.reference)
+                if attribute.name == "Name":
+                    item.setFont(1,self.bold)
+            elif argvalue:
+                # the first value is shown on the attribute row, the others below it
+                self.setAttributeText(item,argvalue[0],attribute.reference)
+                for argitem in argvalue[1:]:
+                    self.setAttributeText(QtGui.QTreeWidgetItem(item),argitem,attribute.reference)
+
+
+    def setAttributeText(self,item,value,reference):
+
+        "shows an attribute value in the second column of a tree item, entity references as links"
+
+        if reference and hasattr(value,"is_a") and value.id():
+            item.setText(1,"#" + self.tostr(value.id()) + ": " + self.tostr(value.is_a()))
+            item.setForeground(1,self.linkbrush)
+            item.setFont(1,self.linkfont)
+        else:
+            t = self.tostr(value)
+            if t != "None":
+                item.setText(1,t)
 
 
     def addProperties(self,eid,parent):
     
         "adds properties of a given entity to the given QTReeWidgetItem"
 
+        import BimIfcExplorerCore
         from PySide import QtCore,QtGui
-        entity = self.ifc[eid]
-        if hasattr(entity,"IsDefinedBy"):
-            for rel in entity.IsDefinedBy:
-                if hasattr(rel,"RelatingPropertyDefinition"):
-                    if rel.RelatingPropertyDefinition:
-                        item = QtGui.QTreeWidgetItem(parent)
-                        item.setText(0,"PropertySet: "+self.tostr(rel.RelatingPropertyDefinition.Name))
-                        item.setFont(0,self.bold)
-                        self.properties.setFirstItemColumnSpanned(item,True)
-                        if hasattr(rel.RelatingPropertyDefinition,"HasProperties"):
-                            for prop in rel.RelatingPropertyDefinition.HasProperties:
-                                subitem = QtGui.QTreeWidgetItem(item)
-                                subitem.setText(0,"Property")
-                                self.addAttributes(prop.id(),subitem)
+        if not self.psetindex:
+            # still loading, the properties are shown when the index is ready
+            return
+        for pset,props in BimIfcExplorerCore.getPropertySets(self.ifc,self.psetindex,eid):
+            item = QtGui.QTreeWidgetItem(parent)
+            item.setText(0,"PropertySet: "+self.tostr(pset.Name))
+            item.setFont(0,self.bold)
+            self.properties.setFirstItemColumnSpanned(item,True)
+            for prop in props:
+                subitem = QtGui.QTreeWidgetItem(item)
+                subitem.setText(0,"Property")
+                self.addAttributes(prop.id(),subitem)
 
 
     def tostr(self,text):
@@ -530,6 +1073,7 @@ class BIM_IfcExplorer:
         
         "displays attributes and properties of a tree item"
 
+        import BimIfcTessellation
         from PySide import QtCore,QtGui
         self.backnav.append(previous)
         eid = item.data(0,QtCore.Qt.UserRole)
@@ -540,22 +1084,15 @@ class BIM_IfcExplorer:
         self.addProperties(eid,self.properties)
         self.properties.expandAll()
         entity = self.ifc[eid]
-        if entity.is_a("IfcProduct") and FreeCAD.ActiveDocument:
-            self.shapeAction.setEnabled(True)
-        else:
-            self.shapeAction.setEnabled(False)
-        if eid in self.omeshes:
-            omesh = self.omeshes[eid]
+        self.exportAction.setEnabled(bool(self.index and entity.is_a("IfcObjectDefinition")))
+        if eid in self.subtreemeshes:
+            omesh = self.subtreemeshes[eid]
         else:
             omesh = None
-        children = self.getChildren(entity,keys=True)
-        for k in children:
-            if k in self.omeshes:
-                kmesh = self.omeshes[k]
-                if omesh:
-                    omesh.addMesh(kmesh)
-                else:
-                    omesh = kmesh
+            arrays = self.getSubtreeArrays(eid)
+            if arrays:
+                omesh = BimIfcTessellation.makeMesh(*arrays)
+            self.subtreemeshes[eid] = omesh
         if omesh:
             if not self.currentmesh:
                 self.currentmesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature","IFCObjectMesh")
@@ -568,17 +1105,191 @@ class BIM_IfcExplorer:
                 self.currentmesh.ViewObject.hide()
 
 
-    def onDoubleClickTree(self,item,column):
+    def onSelectionChanged(self):
 
-        "when a property or attribute is double-clicked"
+        "enables the insert button when products are selected"
+
+        self.shapeAction.setEnabled(bool(FreeCAD.ActiveDocument and self.getSelectedIds()))
+
+
+    def resetSubtreeCaches(self):
+
+        "empties the caches of merged subtree meshes, bounded by the memory limit in low memory mode"
+
+        import BimIfcStepScan
+        maxsize = None
+        if self.lowmemory:
+            # the decoded entities take half of the limit and the search index a quarter
+            maxsize = self.memorylimit//8
+        # merged arrays of the entities that have children
+        self.subtreearrays = BimIfcStepScan.LRUCache(maxsize,lambda arrays: arrays[0].nbytes+arrays[1].nbytes if arrays else 0)
+        # meshes of the entities already selected
+        self.subtreemeshes = BimIfcStepScan.LRUCache(maxsize,lambda mesh: 100*mesh.CountFacets if mesh else 0)
+
+
+    def getSubtreeArrays(self,eid):
+
+        "returns the merged (verts,faces) mesh arrays of an entity and all its children, or None"
+
+        import BimIfcTessellation
+        if not self.index:
+            return None
+        if eid in self.subtreearrays:
+            return self.subtreearrays[eid]
+        arrays = []
+        if eid in self.omeshes:
+            arrays.append(self.omeshes[eid])
+        elif eid in self.meshkeys:
+            # low memory mode: the mesh is read from the tessellation cache
+            cached = self.meshcache.get(self.meshkeys[eid])
+            if cached:
+                arrays.append((cached[0]*self.meshscale,cached[1]))
+        children = self.index.getChildren(eid)
+        for childid in children:
+            childarrays = self.getSubtreeArrays(childid)
+            if childarrays:
+                arrays.append(childarrays)
+        if not arrays:
+            result = None
+        elif len(arrays) == 1:
+            result = arrays[0]
+        else:
+            result = BimIfcTessellation.mergeArrays(arrays)
+        if children:
+            self.subtreearrays[eid] = result
+        return result
+
+
+    def onExpandTree(self,item):
+
+        "adds the children of a tree item the first time it is expanded"
 
         from PySide import QtCore,QtGui
+        if item.data(0,QtCore.Qt.UserRole+1) or not self.index:
+            # still loading, the item is populated when the index is ready
+            return
+        item.setData(0,QtCore.Qt.UserRole+1,True)
+        eid = item.data(0,QtCore.Qt.UserRole)
+        for child in self.getChildren(self.ifc[eid]):
+            self.addEntity(child.id(),item)
+        if not item.childCount():
+            item.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.DontShowIndicatorWhenChildless)
+
+
+    def onSearchChanged(self,text):
+
+        "starts a search shortly after the user stops typing"
+
+        self.searchtimer.start(200)
+
+
+    def doSearch(self):
+
+        "fills the results list with the entities matching the search text"
+
+        from PySide import QtCore,QtGui
+        self.results.clear()
+        text = self.search.text().strip()
+        if not text:
+            self.results.hide()
+            return
+        if not self.searchindex:
+            # the index is still being built by the loader thread, see onFileSearchable
+            item = QtGui.QListWidgetItem(translate("BIM","Building search index..."))
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.results.addItem(item)
+            self.results.show()
+            return
+        eids = self.searchindex.search(text)
+        for eid in eids[:MAX_SEARCH_RESULTS]:
+            try:
+                entity = self.ifc[eid]
+            except RuntimeError:
+                continue
+            name = getattr(entity,"Name",None)
+            item = QtGui.QListWidgetItem("#"+self.tostr(eid)+" : "+self.tostr(entity.is_a())+((" : "+self.tostr(name)) if name else ""))
+            item.setData(QtCore.Qt.UserRole,eid)
+            self.results.addItem(item)
+        if len(eids) > MAX_SEARCH_RESULTS:
+            item = QtGui.QListWidgetItem(self.tostr(len(eids)-MAX_SEARCH_RESULTS)+" "+translate("BIM","more results..."))
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.results.addItem(item)
+        elif not eids:
+            item = QtGui.QListWidgetItem(translate("BIM","No results"))
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.results.addItem(item)
+        if not self.searchindex.complete:
+            item = QtGui.QListWidgetItem(translate("BIM","Partial results: the search index reached the memory limit"))
+            item.setFlags(QtCore.Qt.NoItemFlags)
+            self.results.addItem(item)
+        self.results.show()
+
+
+    def onClickResult(self,item):
+
+        "selects the clicked search result in the tree"
+
+        from PySide import QtCore
+        eid = item.data(QtCore.Qt.UserRole)
+        if eid and not self.selectEntity(eid):
+            # this entity is not part of the tree, only show its attributes
+            self.attributes.clear()
+            self.addAttributes(eid,self.attributes)
+            self.attributes.expandAll()
+            self.properties.clear()
+            self.addProperties(eid,self.properties)
+            self.properties.expandAll()
+
+
+    def getTreeParent(self,entity):
+
+        "returns the entity under which the given entity appears in the tree, or None"
+
+        if not self.index:
+            return None
+        parent = self.index.getParent(entity.id())
+        if parent is not None:
+            return self.ifc[parent]
+        for inverse in self.ifc.get_inverse(entity):
+            if inverse.is_a("IfcProduct") and (inverse.Representation == entity):
+                return inverse
+            elif inverse.is_a("IfcProductRepresentation") and (entity in inverse.Representations):
+                return inverse
+            elif inverse.is_a("IfcShapeRepresentation") and (entity in inverse.Items):
+                return inverse
+        return None
+
+
+    def selectEntity(self,eid):
+
+        "selects the tree item of the given entity id, creating it if needed. Returns False if not in the tree"
+
+        if not eid in self.items:
+            # expand the parents from the top, which creates their children
+            path = []
+            entity = self.ifc[eid]
+            while entity and (not entity.id() in path):
+                path.insert(0,entity.id())
+                if entity.id() in self.items:
+                    break
+                entity = self.getTreeParent(entity)
+            for pid in path[:-1]:
+                if pid in self.items:
+                    self.items[pid].setExpanded(True)
+        if eid in self.items:
+            self.tree.scrollToItem(self.items[eid])
+            self.tree.setCurrentItem(self.items[eid])
+            return True
+        return False
+
+
+    def onDoubleClickTree(self,item,column):
+
+        "when a property or attribute is double-clicked"
 
         if self.tree:
             txt = item.text(column)
             if txt.startswith("#"):
                 eid = txt[1:].split(":")[0]
-                target = self.tree.findItems("#"+eid+" :",QtCore.Qt.MatchStartsWith|QtCore.Qt.MatchRecursive,0)
-                if target:
-                    self.tree.scrollToItem(target[0])
-                    self.tree.setCurrentItem(target[0])
+                if eid.isdigit():
+                    self.selectEntity(int(eid))
@@ -0,0 +1,219 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains the parts of the IFC explorer that don't need a
+GUI: walking the spatial tree, reading attributes and property sets, and
+inspecting whole files. It works without FreeCAD, and can be run from
+the command line to dump the contents of a batch of IFC files as JSON,
+one process per file:
+
+    python BimIfcExplorerCore.py [--tessellate] [--processes N] [--output FILE] file.ifc ...
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+
+import BimIfcIndex
+import BimIfcStepScan
+
+
+def getProducts(ifcfile,index):
+
+    "returns all the products found in the spatial structure of the file"
+
+    products = []
+    for site in ifcfile.by_type("IfcSite"):
+        products.append(site)
+        for eid in index.getDescendants(site.id()):
+            entity = ifcfile[eid]
+            if entity.is_a("IfcProduct"):
+                products.append(entity)
+    return products
+
+
+def getChildren(ifcfile,index,obj):
+
+    """returns a list of the direct children of an entity in the explorer tree:
+    the entities it aggregates or contains, and its representations"""
+
+    children = [ifcfile[eid] for eid in index.getChildren(obj.id())]
+    if hasattr(obj,"Representation"): # Shape representation
+        if obj.Representation:
+            children.append(obj.Representation)
+    if hasattr(obj,"Representations"):
+        children.extend(obj.Representations)
+    if obj.is_a("IfcShapeRepresentation"):
+        children.extend(obj.Items)
+    return children
+
+
+def getAttributes(ifcfile,entity):
+
+    """yields the (name,value) pairs of the attributes of an entity. Raises
+    AttributeError if the entity doesn't match its schema declaration"""
+
+    for name in BimIfcIndex.getAttributeNames(ifcfile,entity):
+        yield name,getattr(entity,name)
+
+
+def getPropertySets(ifcfile,psetindex,eid):
+
+    """returns a list of (property set, [properties]) for the given entity
+    id, psetindex being a BimIfcIndex.IfcPropertyIndex"""
+
+    result = []
+    for psetid in psetindex.getPropertySets(eid):
+        pset = ifcfile[psetid]
+        result.append((pset,list(getattr(pset,"HasProperties",None) or [])))
+    return result
+
+
+def getPropertyValue(ifcfile,prop):
+
+    """returns the value of a property or quantity as a JSON-compatible
+    value: the first of its attributes whose name ends with Value or Values"""
+
+    for name,value in getAttributes(ifcfile,prop):
+        if name.endswith("Value") or name.endswith("Values"):
+            return toJSON(value)
+    return None
+
+
+def toJSON(value):
+
+    """converts an attribute value to a JSON-compatible value. Entities become
+    "#id" strings, typed values their wrapped value, and tuples lists"""
+
+    if isinstance(value,(list,tuple)):
+        return [toJSON(v) for v in value]
+    if hasattr(value,"is_a"):
+        if value.id():
+            return "#"+str(value.id())
+        return toJSON(value.wrappedValue)
+    return value
+
+
+def getTree(ifcfile,index):
+
+    "returns the spatial tree of a file as nested {id,type,name,children} dictionaries"
+
+    def getNode(eid):
+        entity = ifcfile[eid]
+        node = {"id":eid,"type":entity.is_a(),"name":getattr(entity,"Name",None)}
+        children = index.getChildren(eid)
+        if children:
+            node["children"] = [getNode(child) for child in children]
+        return node
+
+    return [getNode(eid) for eid in index.roots]
+
+
+def inspectFile(filename,tessellate=False,properties=True):
+
+    """returns a JSON-compatible dictionary describing an IFC file: its
+    statistics, spatial tree, property sets and, if tessellate is True, the
+    cost of tessellating each of its products (see IfcTessellator)"""
+
+    import ifcopenshell
+    result = {"file":os.path.abspath(filename)}
+    start = time.time()
+    stepindex = BimIfcStepScan.StepIndex(filename)
+    result["stats"] = {"size":stepindex.size,
+                       "schema":stepindex.schema,
+                       "entities":stepindex.getCount(),
+                       "types":stepindex.types}
+    ifcfile = ifcopenshell.open(filename)
+    index = BimIfcIndex.IfcRelationIndex(ifcfile)
+    result["timings"] = {"load":time.time()-start}
+    result["tree"] = getTree(ifcfile,index)
+    if properties:
+        psetindex = BimIfcIndex.IfcPropertyIndex(ifcfile)
+        psets = {}
+        for eid in psetindex.psets:
+            entity = ifcfile[eid]
+            key = getattr(entity,"GlobalId",None) or "#"+str(eid)
+            psets[key] = {}
+            for pset,props in getPropertySets(ifcfile,psetindex,eid):
+                psets[key][pset.Name] = dict([(prop.Name,getPropertyValue(ifcfile,prop)) for prop in props])
+        result["psets"] = psets
+    if tessellate:
+        import BimIfcTessellation
+        start = time.time()
+        tessellator = BimIfcTessellation.IfcTessellator(ifcfile,profile=True)
+        for eid,verts,faces in tessellator.tessellate(getProducts(ifcfile,index)):
+            pass
+        keys = ["id","type","name","seconds","triangles","vertices","representation"]
+        result["tessellation"] = {"seconds":time.time()-start,
+                                  "products":[dict(zip(keys,row)) for row in tessellator.getProfileRows()],
+                                  "failures":dict([("#"+str(k),v) for k,v in tessellator.failures.items()])}
+    return result
+
+
+def inspectFileArgs(args):
+
+    "runs inspectFile with a tuple of arguments, and returns errors instead of raising them"
+
+    try:
+        return inspectFile(*args)
+    except Exception as e:
+        return {"file":os.path.abspath(args[0]),"error":str(e)}
+
+
+def main(argv=None):
+
+    "the command line entry point"
+
+    import argparse
+    import multiprocessing
+    parser = argparse.ArgumentParser(description="Dumps the contents of IFC files as JSON")
+    parser.add_argument("files",nargs="+",help="the IFC files to inspect")
+    parser.add_argument("-o","--output",help="the JSON file to write. Default is the standard output")
+    parser.add_argument("-p","--processes",type=int,default=0,help="the number of files inspected in parallel. Default is the number of cores")
+    parser.add_argument("-t","--tessellate",action="store_true",help="also tessellate the products and report the cost of each")
+    parser.add_argument("--no-properties",action="store_true",help="don't dump the property sets")
+    args = parser.parse_args(argv)
+    tasks = [(f,args.tessellate,not args.no_properties) for f in args.files]
+    processes = min(args.processes or multiprocessing.cpu_count(),len(tasks))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(inspectFileArgs,tasks,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [inspectFileArgs(task) for task in tasks]
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(results,f,indent=1,default=str)
+    else:
+        json.dump(results,sys.stdout,indent=1,default=str)
+        print()
+    return 1 if [r for r in results if "error" in r] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
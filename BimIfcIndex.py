@@ -0,0 +1,353 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains indexes built over the contents of an IFC file,
+used by the IFC explorer"""
+
+from __future__ import print_function
+
+ATTRIBUTES = {} # (schema, type name): [IfcAttribute]
+ATTRIBUTE_NAMES = {} # (schema, type name): attribute names
+SEARCH_WORD_SIZE = 300 # estimated bytes taken by a new word of the search index
+SEARCH_ID_SIZE = 100 # estimated bytes taken by an entity id added to a word
+
+
+class IfcRelationIndex:
+
+    """An index of the spatial structure of an IFC file. It is built in one
+    scan of the IfcRelAggregates and IfcRelContainedInSpatialStructure
+    relationships, and stores the entities in depth-first order, so the
+    descendants of any entity form a contiguous slice of that order"""
+
+    def __init__(self,ifcfile):
+
+        self.parents = {}  # child id: parent id
+        self.children = {} # parent id: [child ids]
+        self.order = []    # all ids, depth-first
+        self.ranges = {}   # id: (start,end) position in self.order
+
+        for rel in ifcfile.by_type("IfcRelAggregates"):
+            self.addRelation(rel.RelatingObject,rel.RelatedObjects)
+        for rel in ifcfile.by_type("IfcRelContainedInSpatialStructure"):
+            self.addRelation(rel.RelatingStructure,rel.RelatedElements)
+        self.roots = [eid for eid in self.children if not eid in self.parents]
+        self.buildOrder()
+
+
+    def addRelation(self,parent,children):
+
+        "registers the given children under the given parent"
+
+        if not parent:
+            return
+        pid = parent.id()
+        for child in children:
+            cid = child.id()
+            if (cid != pid) and (not cid in self.parents):
+                self.parents[cid] = pid
+                self.children.setdefault(pid,[]).append(cid)
+
+
+    def buildOrder(self):
+
+        "walks the structure once, depth-first, and records the range of each entity"
+
+        for root in self.roots:
+            todo = [(root,False)]
+            while todo:
+                eid,closing = todo.pop()
+                if closing:
+                    self.ranges[eid] = (self.ranges[eid][0],len(self.order))
+                elif not eid in self.ranges:
+                    self.ranges[eid] = (len(self.order),None)
+                    self.order.append(eid)
+                    todo.append((eid,True))
+                    for cid in reversed(self.children.get(eid,[])):
+                        todo.append((cid,False))
+
+
+    def getParent(self,eid):
+
+        "returns the id of the parent of the given entity id, or None"
+
+        return self.parents.get(eid,None)
+
+
+    def getChildren(self,eid):
+
+        "returns the ids of the direct children of the given entity id"
+
+        return self.children.get(eid,[])
+
+
+    def getDescendants(self,eid):
+
+        "returns the ids of all the children of the given entity id, recursively"
+
+        if eid in self.ranges:
+            start,end = self.ranges[eid]
+            return self.order[start+1:end]
+        return []
+
+
+    def getAncestors(self,eid):
+
+        "returns the ids of the parents of the given entity id, topmost first"
+
+        ancestors = []
+        eid = self.parents.get(eid,None)
+        while (eid is not None) and (not eid in ancestors):
+            ancestors.insert(0,eid)
+            eid = self.parents.get(eid,None)
+        return ancestors
+
+
+class IfcSearchIndex:
+
+    """An inverted index of the words found in the type, Name, GlobalId and
+    Tag of the IfcRoot entities of an IFC file, and in the values of the
+    properties defined for them. It is built in one scan of the file. Types
+    are also indexed without their Ifc prefix, so "wall" finds IfcWall. If
+    maxsize is given, indexing stops when the estimated size of the index
+    in bytes reaches it, and complete is False"""
+
+    def __init__(self,ifcfile,maxsize=None):
+
+        self.words = {} # word: set of entity ids
+        self.size = 0 # estimated size in bytes
+        self.maxsize = maxsize
+        self.complete = True
+        for entity in ifcfile.by_type("IfcRoot"):
+            if self.isFull():
+                break
+            eid = entity.id()
+            typename = entity.is_a()
+            self.addText(typename,eid)
+            if typename.lower().startswith("ifc"):
+                self.addText(typename[3:],eid)
+            for attribute in ["Name","GlobalId","Tag"]:
+                value = getattr(entity,attribute,None)
+                if value:
+                    self.addText(value,eid)
+        for rel in ifcfile.by_type("IfcRelDefinesByProperties"):
+            if self.isFull():
+                break
+            pset = rel.RelatingPropertyDefinition
+            values = []
+            for prop in getattr(pset,"HasProperties",None) or []:
+                value = getattr(prop,"NominalValue",None)
+                if value is not None:
+                    values.append(value.wrappedValue)
+            for obj in rel.RelatedObjects:
+                for value in values:
+                    self.addText(value,obj.id())
+        self.keys = sorted(self.words)
+
+
+    def isFull(self):
+
+        "returns True, and marks the index as incomplete, if it reached its max size"
+
+        if self.maxsize and (self.size >= self.maxsize):
+            self.complete = False
+        return not self.complete
+
+
+    def addText(self,text,eid):
+
+        "adds the words of the given text to the index, for the given entity id"
+
+        for word in self.split(text):
+            if not word in self.words:
+                self.words[word] = set([eid])
+                self.size += SEARCH_WORD_SIZE + len(word)
+            elif not eid in self.words[word]:
+                self.words[word].add(eid)
+                self.size += SEARCH_ID_SIZE
+
+
+    def split(self,text):
+
+        "returns the lowercase words of a text. GlobalIds are kept in one piece"
+
+        import re
+        if not isinstance(text,str):
+            text = str(text)
+        return [w for w in re.split(r"[^\w$]+",text.lower()) if w]
+
+
+    def search(self,text):
+
+        """returns a sorted list of the ids of the entities that contain words
+        starting with every word of the given text. #number finds an entity id"""
+
+        import bisect
+        result = None
+        for word in text.split():
+            if word.startswith("#") and word[1:].isdigit():
+                found = set([int(word[1:])])
+            else:
+                found = set()
+                for part in self.split(word):
+                    i = bisect.bisect_left(self.keys,part)
+                    while (i < len(self.keys)) and self.keys[i].startswith(part):
+                        found.update(self.words[self.keys[i]])
+                        i += 1
+            if result is None:
+                result = found
+            else:
+                result &= found
+            if not result:
+                break
+        return sorted(result or [])
+
+
+class IfcPropertyIndex:
+
+    """An index of the property sets defined for each entity of an IFC file.
+    It is built in one scan of the IfcRelDefinesByProperties relationships,
+    so the property sets of an entity don't need to be searched through its
+    inverse relationships"""
+
+    def __init__(self,ifcfile):
+
+        self.psets = {} # entity id: [property set ids]
+        for rel in ifcfile.by_type("IfcRelDefinesByProperties"):
+            definitions = rel.RelatingPropertyDefinition
+            if not definitions:
+                continue
+            if not isinstance(definitions,(list,tuple)):
+                definitions = [definitions]
+            for obj in rel.RelatedObjects:
+                self.psets.setdefault(obj.id(),[]).extend([d.id() for d in definitions])
+
+
+    def getPropertySets(self,eid):
+
+        "returns the ids of the property sets defined for the given entity id"
+
+        return self.psets.get(eid,[])
+
+
+class IfcAttribute:
+
+    """The declaration of an attribute of an entity type, as read from the
+    schema: its name, its type, if it is an aggregate, and if it holds
+    entity references. reference is "entity" if its values are always
+    entities, "select" if they can be entities or typed values, and None
+    if they are never entities. When the schema is not available, aggregate
+    is None and reference is "select", as nothing is known"""
+
+    def __init__(self,name,typename="",aggregate=None,reference="select"):
+
+        self.name = name
+        self.typename = typename
+        self.aggregate = aggregate
+        self.reference = reference
+
+
+def getAttributeDeclarations(ifcfile,entity):
+
+    """returns the IfcAttribute declarations of the attributes of an entity.
+    They are read from the schema once per schema and entity type"""
+
+    key = (ifcfile.schema,entity.is_a())
+    if not key in ATTRIBUTES:
+        attributes = None
+        try:
+            from ifcopenshell import ifcopenshell_wrapper
+            declaration = ifcopenshell_wrapper.schema_by_name(key[0]).declaration_by_name(key[1])
+            attributes = []
+            for attribute in declaration.all_attributes():
+                typename,aggregate,reference = getParameterType(attribute.type_of_attribute())
+                attributes.append(IfcAttribute(attribute.name(),typename,aggregate,reference))
+        except (ImportError,RuntimeError,AttributeError):
+            attributes = None
+        if attributes is None:
+            # the schema is not available, ask the entity itself
+            attributes = []
+            while True:
+                try:
+                    attributes.append(IfcAttribute(entity.attribute_name(len(attributes))))
+                except RuntimeError:
+                    break
+        ATTRIBUTES[key] = attributes
+        ATTRIBUTE_NAMES[key] = [attribute.name for attribute in attributes]
+    return ATTRIBUTES[key]
+
+
+def getAttributeNames(ifcfile,entity):
+
+    "returns the names of the attributes of an entity"
+
+    key = (ifcfile.schema,entity.is_a())
+    if not key in ATTRIBUTE_NAMES:
+        getAttributeDeclarations(ifcfile,entity)
+    return ATTRIBUTE_NAMES[key]
+
+
+def getParameterType(parameter):
+
+    """returns the type name of an ifcopenshell schema parameter type, if it
+    is an aggregate, and the kind of entity references it holds (see
+    IfcAttribute)"""
+
+    aggregation = parameter.as_aggregation_type()
+    if aggregation:
+        typename,aggregate,reference = getParameterType(aggregation.type_of_element())
+        return aggregation.type_of_aggregation_string().upper()+" OF "+typename,True,reference
+    named = parameter.as_named_type()
+    if named:
+        declared = named.declared_type()
+        if declared.as_entity():
+            return declared.name(),False,"entity"
+        if declared.as_select_type():
+            return declared.name(),False,getSelectReference(declared.as_select_type())
+        if declared.as_type_declaration():
+            # a defined type, its values are never entities but can be lists
+            aggregate = getParameterType(declared.as_type_declaration().declared_type())[1]
+            return declared.name(),aggregate,None
+        return declared.name(),False,None
+    simple = parameter.as_simple_type()
+    if simple:
+        return simple.declared_type().upper(),False,None
+    return "",None,"select"
+
+
+def getSelectReference(select):
+
+    """returns "entity" if the given schema select type only holds entities,
+    "select" if it can hold entities and other values, or None"""
+
+    kinds = set()
+    for item in select.select_list():
+        if item.as_entity():
+            kinds.add("entity")
+        elif item.as_select_type():
+            kinds.add(getSelectReference(item.as_select_type()))
+        else:
+            kinds.add(None)
+    if kinds == set(["entity"]):
+        return "entity"
+    if ("entity" in kinds) or ("select" in kinds):
+        return "select"
+    return None
@@ -26,6 +26,7 @@
 
 import os
 import FreeCAD
+import BimFingerprint
 from BimTranslateUtils import *
 
 qprops = ["Length","Width","Height","Area","HorizontalArea","VerticalArea","Volume"] # quantities columns
@@ -145,7 +146,7 @@ class BIM_IfcQuantities:
                                     val = None
                                     if prop == "Volume":
                                         if obj.Shape and hasattr(obj.Shape,"Volume"):
-                                            val = FreeCAD.Units.Quantity(obj.Shape.Volume,FreeCAD.Units.Volume)
+                                            val = FreeCAD.Units.Quantity(BimFingerprint.getFingerprint(obj).volume,FreeCAD.Units.Volume)
                                             it.setText(val.getUserPreferred()[0].replace(u"^3",u"³"))
                                             it.setCheckable(True)
                                     else:
@@ -0,0 +1,610 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains a fast scanner for IFC files in the STEP
+(ISO-10303-21) text format. It reads the file without parsing it, and
+doesn't depend on ifcopenshell."""
+
+from __future__ import print_function
+
+import re
+import mmap
+import threading
+import array
+import bisect
+import collections
+
+RECORD = re.compile(br"^\s*#(\d+)\s*=\s*([A-Za-z0-9_]+)",re.M)
+HEADER = re.compile(br"HEADER;(.*?)ENDSEC;",re.S)
+HEADER_ENTITY = re.compile(br"([A-Z_]+)\s*\((.*?)\)\s*;",re.S)
+SCHEMA = re.compile(br"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'")
+
+
+class StepIndex:
+
+    """Scans an IFC file once, with memory-mapped I/O, and stores its header,
+    schema, the number of entities of each type, and the byte offset of
+    every #id record, so records can later be read directly"""
+
+    def __init__(self,filename):
+
+        self.filename = filename
+        self.header = {} # header entity name: its raw arguments
+        self.schema = ""
+        self.types = {} # upper-case type name: count
+        self.typenames = [] # upper-case type names
+        self.ids = array.array("q") # entity ids
+        self.offsets = array.array("q") # byte offsets, in the same order as self.ids
+        self.typecodes = array.array("H") # positions in self.typenames, in the same order as self.ids
+        self.size = 0
+        with open(filename,"rb") as f:
+            data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+                self.size = len(data)
+                self.scanHeader(data[:65536])
+                self.scanRecords(data)
+            finally:
+                data.close()
+
+
+    def scanHeader(self,data):
+
+        "reads the header section from the beginning of the file"
+
+        m = HEADER.search(data)
+        if m:
+            for name,args in HEADER_ENTITY.findall(m.group(1)):
+                self.header[name.decode("utf8")] = args.decode("utf8","replace")
+        m = SCHEMA.search(data)
+        if m:
+            self.schema = m.group(1).decode("utf8").upper()
+
+
+    def scanRecords(self,data):
+
+        "records the id, type and offset of every entity of the file"
+
+        codes = {}
+        ordered = True
+        last = -1
+        for m in RECORD.finditer(data):
+            eid = int(m.group(1))
+            if eid < last:
+                ordered = False
+            last = eid
+            self.ids.append(eid)
+            self.offsets.append(m.start(1)-1)
+            t = m.group(2)
+            if not t in codes:
+                codes[t] = len(codes)
+            self.typecodes.append(codes[t])
+        self.typenames = [None] * len(codes)
+        for t,code in codes.items():
+            self.typenames[code] = t.decode("utf8").upper()
+        counts = [0] * len(codes)
+        for code in self.typecodes:
+            counts[code] += 1
+        self.types = dict(zip(self.typenames,counts))
+        if not ordered:
+            triples = sorted(zip(self.ids,self.offsets,self.typecodes))
+            self.ids = array.array("q",[t[0] for t in triples])
+            self.offsets = array.array("q",[t[1] for t in triples])
+            self.typecodes = array.array("H",[t[2] for t in triples])
+
+
+    def getCount(self):
+
+        "returns the number of entities of the file"
+
+        return len(self.ids)
+
+
+    def getOffset(self,eid):
+
+        "returns the byte offset of the record of the given entity id, or None"
+
+        i = bisect.bisect_left(self.ids,eid)
+        if (i < len(self.ids)) and (self.ids[i] == eid):
+            return self.offsets[i]
+        return None
+
+
+    def readRecord(self,eid,f=None):
+
+        """returns the raw text of the record of the given entity id, for ex.
+        "#12=IFCWALL(...);", or None. An already open binary file can be given"""
+
+        offset = self.getOffset(eid)
+        if offset is None:
+            return None
+        if f is None:
+            with open(self.filename,"rb") as f:
+                return readRecordAt(f,offset)
+        return readRecordAt(f,offset)
+
+
+def readRecordAt(f,offset):
+
+    "reads the record starting at the given offset of an open binary file, up to its final semicolon"
+
+    f.seek(offset)
+    chunks = []
+    quoted = False
+    while True:
+        chunk = f.read(4096)
+        if not chunk:
+            break
+        for i,c in enumerate(bytearray(chunk)):
+            if c == 39: # '
+                quoted = not quoted
+            elif (c == 59) and not quoted: # ;
+                chunks.append(chunk[:i+1])
+                return b"".join(chunks).decode("utf8","replace")
+        chunks.append(chunk)
+    return b"".join(chunks).decode("utf8","replace")
+
+
+class LRUCache:
+
+    """A dictionary that forgets its least recently used items when the total
+    size of its items exceeds maxsize. The size of each item is given by the
+    getsize function. If maxsize is None, nothing is ever forgotten"""
+
+    def __init__(self,maxsize=None,getsize=None):
+
+        self.maxsize = maxsize
+        self.getsize = getsize or (lambda value: 1)
+        self.items = collections.OrderedDict()
+        self.sizes = {}
+        self.size = 0
+
+
+    def __contains__(self,key):
+
+        return key in self.items
+
+
+    def __len__(self):
+
+        return len(self.items)
+
+
+    def __getitem__(self,key):
+
+        value = self.items.pop(key)
+        self.items[key] = value # put it back at the end, as the most recent
+        return value
+
+
+    def __setitem__(self,key,value):
+
+        if key in self.items:
+            self.remove(key)
+        size = self.getsize(value)
+        self.items[key] = value
+        self.sizes[key] = size
+        self.size += size
+        if self.maxsize is not None:
+            while (self.size > self.maxsize) and (len(self.items) > 1):
+                self.remove(next(iter(self.items)))
+
+
+    def remove(self,key):
+
+        "forgets the given key"
+
+        del self.items[key]
+        self.size -= self.sizes.pop(key)
+
+
+    def clear(self):
+
+        "forgets everything"
+
+        self.items.clear()
+        self.sizes.clear()
+        self.size = 0
+
+
+class Reference(int):
+
+    "an #id reference found in a STEP record"
+
+    pass
+
+
+class TypedValue:
+
+    "a typed value found in a STEP record, for ex. IFCLABEL('text')"
+
+    def __init__(self,typename,args):
+
+        self.typename = typename
+        self.args = args
+
+
+def parseRecord(text):
+
+    """parses the text of a STEP record such as "#12=IFCWALL(...);" and returns
+    its id, its upper-case type and its list of arguments. References are
+    returned as Reference, typed values as TypedValue, $ and * as None"""
+
+    head,body = text.split("=",1)
+    eid = int(head.strip()[1:])
+    i = body.index("(")
+    typename = body[:i].strip().upper()
+    root = None
+    stack = []
+    current = None
+    for m in TOKEN.finditer(body,i):
+        opening,closing,string,ref,unset,enum,typed,binary,number = m.groups()
+        if (opening is not None) or (typed is not None):
+            values = []
+            if current is not None:
+                if typed is not None:
+                    current.append(TypedValue(typed.upper(),values))
+                else:
+                    current.append(values)
+            else:
+                root = values
+            stack.append(current)
+            current = values
+        elif closing is not None:
+            current = stack.pop()
+            if current is None:
+                break
+        elif string is not None:
+            current.append(decodeString(string))
+        elif ref is not None:
+            current.append(Reference(ref))
+        elif unset is not None:
+            current.append(None)
+        elif enum is not None:
+            current.append({"T":True,"F":False}.get(enum,enum))
+        elif binary is not None:
+            current.append(binary)
+        elif number is not None:
+            if ("." in number) or ("E" in number.upper()):
+                current.append(float(number))
+            else:
+                current.append(int(number))
+    return eid,typename,root or []
+
+
+def removeReferences(text,ids):
+
+    """returns the text of a STEP record with the given #id references
+    removed from it, with their separating commas"""
+
+    body = text.index("(",text.index("="))
+    tokens = [] # text of the kept tokens
+    end = body
+    for m in TOKEN.finditer(text,body):
+        end = m.end()
+        if (m.group(4) is not None) and (int(m.group(4)) in ids):
+            continue
+        token = text[m.start():m.end()]
+        if token.strip() == ",":
+            # a comma after an opening parenthesis or another comma is left over
+            if tokens and (tokens[-1].strip()[-1:] in ["(",","]):
+                continue
+        elif (token.strip() == ")") and tokens and (tokens[-1].strip() == ","):
+            tokens.pop()
+        tokens.append(token)
+    return text[:body]+"".join(tokens)+text[end:]
+
+
+TOKEN = re.compile(r"""\s*(?:(\()|(\))|'((?:[^']|'')*)'|#(\d+)|([$*])|\.([A-Za-z0-9_]+)\.|([A-Za-z][A-Za-z0-9_]*)\s*\(|"([0-9A-Fa-f]*)"|([-+0-9.Ee]+)|,)""")
+ENCODED = re.compile(r"\\X2\\((?:[0-9A-F]{4})+)\\X0\\|\\X\\([0-9A-F]{2})|\\S\\(.)")
+
+
+def decodeString(text):
+
+    "decodes the escape sequences of a STEP string"
+
+    def decode(m):
+        if m.group(1):
+            return "".join([unichr(int(m.group(1)[i:i+4],16)) for i in range(0,len(m.group(1)),4)])
+        elif m.group(2):
+            return unichr(int(m.group(2),16))
+        return unichr(ord(m.group(3))+128)
+
+    text = text.replace("''","'")
+    if "\\" in text:
+        text = ENCODED.sub(decode,text).replace("\\\\","\\")
+    return text
+
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+class StepFile:
+
+    """Gives access to the entities of an IFC file through a StepIndex,
+    without loading the file. Entities are read and decoded when needed, and
+    only a bounded number of decoded entities is kept in memory (maxsize is
+    the estimated memory they can use, in bytes). It mimics the parts of the
+    ifcopenshell file API used by the IFC explorer"""
+
+    def __init__(self,stepindex,maxsize=None):
+
+        self.index = stepindex
+        self.schema = stepindex.schema
+        self.decoded = LRUCache(maxsize,lambda record: record[2])
+        self.file = open(stepindex.filename,"rb")
+        self.lock = threading.Lock() # the file and the cache can be used from several threads
+        self.declarations = {} # upper-case type name: schema declaration
+        self.subtypes = {} # (type name, name): True if type name is name or a subtype of it
+        self.inverses = {} # (relationship type, attribute): {target id: [relationship ids]}
+        try:
+            from ifcopenshell import ifcopenshell_wrapper
+            self.wrapper = ifcopenshell_wrapper.schema_by_name(self.schema)
+        except (ImportError,RuntimeError,AttributeError):
+            self.wrapper = None
+
+
+    def __getitem__(self,eid):
+
+        if self.index.getOffset(eid) is None:
+            raise RuntimeError("Instance #"+str(eid)+" not found")
+        return StepEntity(self,eid)
+
+
+    def close(self):
+
+        "closes the file"
+
+        with self.lock:
+            self.file.close()
+            self.decoded.clear()
+
+
+    def decode(self,eid):
+
+        "returns the upper-case type and the arguments of the given entity id"
+
+        with self.lock:
+            if eid in self.decoded:
+                return self.decoded[eid][:2]
+            text = self.index.readRecord(eid,self.file)
+        if text is None:
+            raise RuntimeError("Instance #"+str(eid)+" not found")
+        i,typename,args = parseRecord(text)
+        # rough estimate of the memory used by the decoded record
+        record = (typename,args,200+8*len(text))
+        with self.lock:
+            self.decoded[eid] = record
+        return record[0],record[1]
+
+
+    def getDeclaration(self,typename):
+
+        "returns the schema declaration of the given type name, or None"
+
+        typename = typename.upper()
+        if not typename in self.declarations:
+            declaration = None
+            if self.wrapper:
+                try:
+                    declaration = self.wrapper.declaration_by_name(typename)
+                except (RuntimeError,IndexError):
+                    pass
+            self.declarations[typename] = declaration
+        return self.declarations[typename]
+
+
+    def getTypeName(self,typename):
+
+        "returns the type name with its schema capitalization, for ex. IfcWall"
+
+        declaration = self.getDeclaration(typename)
+        if declaration:
+            return declaration.name()
+        return typename
+
+
+    def isSubtype(self,typename,name):
+
+        "returns True if the given type is the given name or a subtype of it"
+
+        key = (typename.upper(),name.upper())
+        if not key in self.subtypes:
+            result = (key[0] == key[1])
+            declaration = self.getDeclaration(typename)
+            while declaration and (not result) and hasattr(declaration,"supertype"):
+                declaration = declaration.supertype()
+                if declaration:
+                    result = (declaration.name().upper() == key[1])
+            self.subtypes[key] = result
+        return self.subtypes[key]
+
+
+    def getAttributeNames(self,typename):
+
+        "returns the names of the attributes and inverse attributes of a type"
+
+        declaration = self.getDeclaration(typename)
+        if declaration and hasattr(declaration,"all_attributes"):
+            return [a.name() for a in declaration.all_attributes()],[a.name() for a in declaration.all_inverse_attributes()]
+        return [],[]
+
+
+    def by_type(self,name):
+
+        "returns all the entities of the given type or of its subtypes"
+
+        import numpy
+        wanted = [code for code,typename in enumerate(self.index.typenames) if self.isSubtype(typename,name)]
+        codes = numpy.frombuffer(self.index.typecodes,dtype=numpy.uint16)
+        ids = numpy.frombuffer(self.index.ids,dtype=numpy.int64)[numpy.isin(codes,wanted)]
+        return [StepEntity(self,eid) for eid in ids.tolist()]
+
+
+    def getInverse(self,typename,name,eid):
+
+        """returns the entities that refer to the given entity id through the
+        given inverse attribute of the given type. The first time an inverse
+        attribute is requested, all the relationships it uses are read"""
+
+        declaration = self.getDeclaration(typename)
+        for attribute in declaration.all_inverse_attributes():
+            if attribute.name() == name:
+                key = (attribute.entity_reference().name(),attribute.attribute_reference().name())
+                break
+        else:
+            return ()
+        if not key in self.inverses:
+            inverse = {}
+            for rel in self.by_type(key[0]):
+                targets = getattr(rel,key[1])
+                if not isinstance(targets,(list,tuple)):
+                    targets = [targets]
+                for target in targets:
+                    if isinstance(target,StepEntity):
+                        inverse.setdefault(target.id(),[]).append(rel.id())
+            self.inverses[key] = inverse
+        return tuple([StepEntity(self,rid) for rid in self.inverses[key].get(eid,[])])
+
+
+    def get_inverse(self,entity):
+
+        "not available without loading the file. Always returns an empty list"
+
+        return []
+
+
+class StepEntity:
+
+    """An entity of a StepFile. It only stores its id, and decodes its record
+    when one of its attributes is requested. Typed values, such as
+    IfcLabel('text'), have an id of 0 and store their own arguments"""
+
+    def __init__(self,stepfile,eid,typename=None,args=None):
+
+        self.stepfile = stepfile
+        self.eid = eid
+        self.typename = typename
+        self.args = args
+
+
+    def getRecord(self):
+
+        "returns the upper-case type and the arguments of this entity"
+
+        if self.eid:
+            return self.stepfile.decode(self.eid)
+        return self.typename,self.args
+
+
+    def convert(self,value):
+
+        "converts a decoded argument to the values returned by ifcopenshell"
+
+        if isinstance(value,Reference):
+            return StepEntity(self.stepfile,int(value))
+        elif isinstance(value,TypedValue):
+            return StepEntity(self.stepfile,0,value.typename,value.args)
+        elif isinstance(value,list):
+            return tuple([self.convert(v) for v in value])
+        return value
+
+
+    def id(self):
+
+        return self.eid
+
+
+    def is_a(self,name=None):
+
+        typename = self.getRecord()[0]
+        if name is None:
+            return self.stepfile.getTypeName(typename)
+        return self.stepfile.isSubtype(typename,name)
+
+
+    def attribute_name(self,i):
+
+        names = self.stepfile.getAttributeNames(self.getRecord()[0])[0]
+        if i >= len(names):
+            raise RuntimeError("Attribute index "+str(i)+" out of range")
+        return names[i]
+
+
+    def get_info(self):
+
+        typename,args = self.getRecord()
+        names = self.stepfile.getAttributeNames(typename)[0]
+        info = {"id":self.eid,"type":self.is_a()}
+        for name,value in zip(names,args):
+            info[name] = self.convert(value)
+        return info
+
+
+    def __getattr__(self,name):
+
+        if name.startswith("_"):
+            raise AttributeError(name)
+        typename,args = self.getRecord()
+        if (not self.eid) and (name == "wrappedValue"):
+            return self.convert(args[0]) if args else None
+        names,inverses = self.stepfile.getAttributeNames(typename)
+        if name in names:
+            i = names.index(name)
+            return self.convert(args[i]) if i < len(args) else None
+        if name in inverses:
+            return self.stepfile.getInverse(typename,name,self.eid)
+        raise AttributeError("entity instance of type '"+self.is_a()+"' has no attribute '"+name+"'")
+
+
+    def __eq__(self,other):
+
+        if isinstance(other,StepEntity) and self.eid:
+            return self.eid == other.eid
+        return self is other
+
+
+    def __ne__(self,other):
+
+        return not self.__eq__(other)
+
+
+    def __hash__(self):
+
+        return hash(self.eid) if self.eid else id(self)
+
+
+    def __str__(self):
+
+        typename,args = self.getRecord()
+        if self.eid:
+            return "#"+str(self.eid)+"="+self.is_a()+"("+",".join([repr(self.convert(a)) for a in args])+")"
+        return self.is_a()+"("+",".join([repr(self.convert(a)) for a in args])+")"
+
+
+    def __repr__(self):
+
+        if self.eid:
+            return "#"+str(self.eid)+"="+self.is_a()+"(...)"
+        return str(self)
@@ -0,0 +1,156 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module extracts parts of an IFC file into standalone IFC files. The
+records are copied as they are written in the original file, so it works
+both with files opened with ifcopenshell and with BimIfcStepScan.StepFile"""
+
+from __future__ import print_function
+
+import time
+
+# the inverse attributes followed from each extracted object
+RELATIONS = ["IsDecomposedBy","ContainsElements","IsDefinedBy","IsTypedBy","HasAssociations","HasOpenings","HasFillings"]
+
+
+class IfcSubset:
+
+    """The entities needed to write an object of an IFC file and all its
+    children as a standalone IFC file: the objects themselves, their spatial
+    parents up to the project, openings and fillings, the relationships
+    between them (with references to other objects removed), and everything
+    these entities reference, such as placements, representations,
+    materials, property sets, types and owner history. The forward references
+    are followed in one traversal, reading each record only once"""
+
+    def __init__(self,ifcfile,index,stepindex,eid):
+
+        self.stepindex = stepindex
+        self.objects = set() # ids of the extracted objects
+        self.removed = {} # relationship id: ids of the objects to remove from its lists
+        self.ids = set() # ids of all the entities to write
+
+        # objects
+        todo = [eid] + index.getDescendants(eid) + index.getAncestors(eid)
+        todo.extend([project.id() for project in ifcfile.by_type("IfcProject")])
+        self.objects.update(todo)
+        for oid in todo:
+            for rel in getattr(ifcfile[oid],"HasOpenings",None) or []:
+                opening = rel.RelatedOpeningElement
+                self.objects.add(opening.id())
+                for fill in getattr(opening,"HasFillings",None) or []:
+                    self.objects.add(fill.RelatedBuildingElement.id())
+
+        # relationships
+        rels = {}
+        for oid in self.objects:
+            obj = ifcfile[oid]
+            for name in RELATIONS:
+                for rel in getattr(obj,name,None) or []:
+                    if not rel.id() in rels:
+                        rels[rel.id()] = rel
+        for rid,rel in rels.items():
+            removed = self.getRemoved(rel)
+            if removed is not None:
+                self.removed[rid] = removed
+
+        # forward references, in one traversal
+        with open(stepindex.filename,"rb") as f:
+            self.addReferences(list(self.objects)+list(self.removed),f)
+            # styles refer to the geometry they apply to, not the other way around
+            styled = []
+            for item in ifcfile.by_type("IfcStyledItem"):
+                target = item.Item
+                if target and (target.id() in self.ids):
+                    styled.append(item.id())
+            self.addReferences(styled,f)
+
+
+    def getRemoved(self,rel):
+
+        """returns the ids referenced by the lists of related objects of a
+        relationship that are not extracted, or None if the relationship
+        doesn't relate any extracted object"""
+
+        removed = set()
+        for name,value in rel.get_info().items():
+            if name.startswith("Related"):
+                if isinstance(value,(list,tuple)):
+                    ids = set([v.id() for v in value])
+                    if not (ids & self.objects):
+                        return None
+                    removed.update(ids - self.objects)
+                elif value and not (value.id() in self.objects):
+                    return None
+        return removed
+
+
+    def addReferences(self,ids,f):
+
+        "adds the given entity ids and all the entities they reference, recursively"
+
+        import BimIfcStepScan
+        todo = [i for i in ids if not i in self.ids]
+        self.ids.update(todo)
+        while todo:
+            eid = todo.pop()
+            text = self.stepindex.readRecord(eid,f)
+            if text is None:
+                continue
+            removed = self.removed.get(eid,())
+            values = BimIfcStepScan.parseRecord(text)[2]
+            while values:
+                value = values.pop()
+                if isinstance(value,BimIfcStepScan.Reference):
+                    if (not value in self.ids) and (not value in removed):
+                        self.ids.add(value)
+                        todo.append(int(value))
+                elif isinstance(value,list):
+                    values.extend(value)
+                elif isinstance(value,BimIfcStepScan.TypedValue):
+                    values.extend(value.args)
+
+
+    def write(self,filename):
+
+        """writes the extracted entities to a new IFC file, keeping their ids,
+        and returns the number of entities written"""
+
+        import BimIfcStepScan
+        header = self.stepindex.header
+        with open(self.stepindex.filename,"rb") as f:
+            with open(filename,"w") as out:
+                out.write("ISO-10303-21;\nHEADER;\n")
+                out.write("FILE_DESCRIPTION("+header.get("FILE_DESCRIPTION","('ViewDefinition [CoordinationView]'),'2;1'")+");\n")
+                out.write("FILE_NAME('"+filename.replace("'","''")+"','"+time.strftime("%Y-%m-%dT%H:%M:%S")+"',(''),(''),'','BIM Workbench','');\n")
+                out.write("FILE_SCHEMA(('"+self.stepindex.schema+"'));\n")
+                out.write("ENDSEC;\nDATA;\n")
+                # sorting by id reads the original file sequentially
+                for eid in sorted(self.ids):
+                    text = self.stepindex.readRecord(eid,f)
+                    if text is None:
+                        continue
+                    if self.removed.get(eid):
+                        text = BimIfcStepScan.removeReferences(text,self.removed[eid])
+                    out.write(text.strip()+"\n")
+                out.write("ENDSEC;\nEND-ISO-10303-21;\n")
+        return len(self.ids)
@@ -0,0 +1,554 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains the tessellation engine used by the IFC explorer.
+It needs ifcopenshell and numpy, and FreeCAD only to build meshes (see
+makeMesh)"""
+
+from __future__ import print_function
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import multiprocessing
+
+MAX_MANIFESTS = 100 # the max number of files whose product keys are kept in the cache
+
+
+class IfcTessellator:
+
+    """Tessellates products of an IFC file with the ifcopenshell geometry
+    iterator, which spreads the work over several threads. If threads is 0,
+    all the available cores are used. If an IfcTessellationCache and the
+    hash of the IFC file (see getFileHash) are given, products found in the
+    cache are not tessellated again, and new tessellations are added to it.
+    Products made of mapped items are tessellated in local coordinates, so
+    each shared representation map is only tessellated once and then moved
+    in place for each product, its faces array being shared. If profile is
+    True, the products are tessellated one after the other in a single
+    thread, without using the cache, and the cost of each is recorded"""
+
+    def __init__(self,ifcfile,threads=0,cache=None,filehash=None,profile=False):
+
+        from ifcopenshell import geom
+        self.ifc = ifcfile
+        self.threads = threads or multiprocessing.cpu_count()
+        self.cache = cache
+        self.filehash = filehash
+        self.profile = None
+        if profile:
+            self.threads = 1
+            self.profile = {} # product id: (seconds, triangles, vertices, representation type)
+        self.settings = geom.settings()
+        self.settings.set(self.settings.USE_WORLD_COORDS,True)
+        self.localsettings = geom.settings()
+        self.failures = {} # product id: error message
+
+
+    def tessellate(self,products,callback=None):
+
+        """yields (product id, verts, faces) for each given product, verts and
+        faces being numpy arrays of shape (n,3) (see getArrays), in metres.
+        If given, callback(count,total) is called after each product.
+        Products that could not be tessellated are recorded in self.failures,
+        with the errors reported by ifcopenshell. This can run in another
+        thread than the one that opened the file"""
+
+        from ifcopenshell import geom
+        self.failures = {}
+        products = [p for p in products if getattr(p,"Representation",None)]
+        if not products:
+            return
+        total = len(products)
+        count = 0
+        keys = {}
+        if self.cache and self.filehash and (self.profile is None):
+            keys = self.cache.getKeys(self.filehash,self.ifc,products,getSettingsKey())
+            remaining = []
+            for product in products:
+                cached = self.cache.get(keys[product.id()])
+                if cached:
+                    count += 1
+                    yield product.id(),cached[0],cached[1]
+                    if callback:
+                        callback(count,total)
+                else:
+                    remaining.append(product)
+            products = remaining
+        todo = set([p.id() for p in products])
+        added = []
+        templates = {} # geometry id: (verts,faces) of a shared representation, in local coordinates
+        mapped = set([p.id() for p in products if isMapped(p)])
+        passes = [(self.settings,[p for p in products if not p.id() in mapped]),(self.localsettings,[p for p in products if p.id() in mapped])]
+        try:
+            for settings,group in passes:
+                if not group:
+                    continue
+                iterator = geom.iterator(settings,self.ifc,self.threads,include=group)
+                # with a single thread, each shape is computed by the
+                # initialize() or next() call that precedes it
+                start = time.time()
+                if not iterator.initialize():
+                    continue
+                while True:
+                    shape = iterator.get()
+                    if shape.id in todo:
+                        todo.remove(shape.id)
+                        count += 1
+                        if settings is self.settings:
+                            verts,faces = getArrays(shape.geometry)
+                        else:
+                            # the iterator gives the same geometry id to products sharing a representation
+                            if not shape.geometry.id in templates:
+                                templates[shape.geometry.id] = getArrays(shape.geometry)
+                            verts,faces = templates[shape.geometry.id]
+                            verts = transformArrays(verts,shape.transformation.matrix)
+                        if self.profile is not None:
+                            self.profile[shape.id] = (time.time()-start,len(faces),len(verts),getRepresentationType(self.ifc[shape.id]))
+                        if keys:
+                            added.append((keys[shape.id],verts,faces))
+                        yield shape.id,verts,faces
+                        if callback:
+                            callback(count,total)
+                    start = time.time()
+                    if not iterator.next():
+                        break
+            # the iterator skips the products it can't process without saying
+            # why, so these are processed again one by one to get the error
+            for eid in sorted(todo):
+                getLogErrors() # clears the log
+                start = time.time()
+                try:
+                    shape = geom.create_shape(self.settings,self.ifc[eid])
+                except RuntimeError as e:
+                    self.failures[eid] = " ".join([str(e),getLogErrors()]).strip()
+                    continue
+                count += 1
+                verts,faces = getArrays(shape.geometry)
+                if self.profile is not None:
+                    self.profile[eid] = (time.time()-start,len(faces),len(verts),getRepresentationType(self.ifc[eid]))
+                if keys:
+                    added.append((keys[eid],verts,faces))
+                yield eid,verts,faces
+                if callback:
+                    callback(count,total)
+        finally:
+            # also store what was done if the caller stopped early
+            if keys:
+                self.cache.add(added)
+
+
+    def getProfileRows(self):
+
+        """returns the recorded profile as a list of (product id, type, name,
+        seconds, triangles, vertices, representation type), heaviest first"""
+
+        rows = []
+        for eid,(seconds,triangles,vertices,representation) in self.profile.items():
+            product = self.ifc[eid]
+            rows.append((eid,product.is_a(),getattr(product,"Name",None) or "",seconds,triangles,vertices,representation))
+        rows.sort(key=lambda row: row[3],reverse=True)
+        return rows
+
+
+    def writeProfile(self,filename):
+
+        "writes the recorded profile to a CSV file"
+
+        import BimIfcUtils
+        BimIfcUtils.writeCSV(filename,["Id","Type","Name","Seconds","Triangles","Vertices","Representation"],self.getProfileRows())
+
+
+def getLogErrors():
+
+    """returns the errors logged by ifcopenshell since the last call, on one
+    line. The log is emptied each time it is read"""
+
+    import ifcopenshell
+    if not hasattr(ifcopenshell,"get_log"):
+        return ""
+    log = ifcopenshell.get_log()
+    errors = re.findall(r"^\[error\](?: \[[^\]\n]*\])* (.*?)(?=^\[|\Z)",log,re.M|re.S|re.I)
+    return " ".join([" ".join(error.split()) for error in errors])
+
+
+def isMapped(product):
+
+    """returns True if the body representation of a product is only made of
+    mapped items, and has no openings that would make it unique"""
+
+    if getattr(product,"HasOpenings",None):
+        return False
+    for representation in product.Representation.Representations:
+        if representation.RepresentationIdentifier == "Body":
+            items = representation.Items
+            return bool(items) and all([item.is_a("IfcMappedItem") for item in items])
+    return False
+
+
+def transformArrays(verts,matrix):
+
+    """returns the given (n,3) vertices transformed by an ifcopenshell
+    transformation matrix, given column by column as 12 or 16 numbers"""
+
+    import numpy
+    matrix = numpy.array(getattr(matrix,"data",matrix),dtype=numpy.float64).reshape(4,-1)
+    return numpy.dot(verts,matrix[:3,:3])+matrix[3,:3]
+
+
+def getRepresentationType(product):
+
+    """returns the RepresentationType of the body representation of a product,
+    or of its first shape representation, for ex. SweptSolid or Brep"""
+
+    types = []
+    if product.Representation:
+        for representation in product.Representation.Representations:
+            if representation.RepresentationType:
+                if representation.RepresentationIdentifier == "Body":
+                    return representation.RepresentationType
+                types.append(representation.RepresentationType)
+    return types[0] if types else ""
+
+
+def getSettingsKey():
+
+    "returns a string identifying the settings and version used to tessellate"
+
+    import ifcopenshell
+    return "USE_WORLD_COORDS;"+getattr(ifcopenshell,"version","")
+
+
+def getArrays(geometry):
+
+    """returns the vertices and faces of an ifcopenshell triangulation as
+    numpy arrays of shape (n,3). When ifcopenshell exposes its raw buffers,
+    the arrays are built on them without copying"""
+
+    import numpy
+    if hasattr(geometry,"verts_buffer"):
+        verts = numpy.frombuffer(geometry.verts_buffer,dtype=numpy.float64)
+        faces = numpy.frombuffer(geometry.faces_buffer,dtype=numpy.int32)
+    else:
+        verts = numpy.array(geometry.verts,dtype=numpy.float64)
+        faces = numpy.array(geometry.faces,dtype=numpy.int32)
+    return verts.reshape(-1,3),faces.reshape(-1,3)
+
+
+def mergeArrays(arrays):
+
+    """merges a list of (verts,faces) numpy arrays into a single (verts,faces)
+    pair, offsetting the face indices accordingly"""
+
+    import numpy
+    if not arrays:
+        return numpy.zeros((0,3),dtype=numpy.float64),numpy.zeros((0,3),dtype=numpy.int32)
+    offsets = numpy.cumsum([0]+[len(verts) for verts,faces in arrays[:-1]])
+    verts = numpy.concatenate([verts for verts,faces in arrays])
+    faces = numpy.concatenate([faces+offset for (verts,faces),offset in zip(arrays,offsets)])
+    return verts,faces
+
+
+def decimateArrays(verts,faces,maxfaces):
+
+    """returns simplified (verts,faces) arrays with at most maxfaces faces, by
+    vertex clustering: the vertices are merged on a regular grid, coarser
+    and coarser until the number of remaining faces fits. Faces that
+    collapse to a line or a point are removed. If the grid gets so coarse
+    that no face is left, the last grid that kept faces is used, or the
+    arrays are returned unchanged"""
+
+    import numpy
+    if len(faces) <= maxfaces:
+        return verts,faces
+    origin = verts.min(axis=0)
+    size = (verts.max(axis=0)-origin).max()
+    if size <= 0:
+        return verts,faces
+    # the number of faces of a surface grows with the square of the grid resolution
+    cells = max(1,int(numpy.sqrt(maxfaces)))
+    result = None
+    while True:
+        coords = numpy.minimum(((verts-origin)*(cells/size)).astype(numpy.int64),cells-1)
+        keys = (coords[:,0]*cells+coords[:,1])*cells+coords[:,2]
+        clusters,inverse = numpy.unique(keys,return_inverse=True)
+        inverse = inverse.reshape(-1)
+        newfaces = inverse[faces]
+        newfaces = newfaces[(newfaces[:,0] != newfaces[:,1]) & (newfaces[:,1] != newfaces[:,2]) & (newfaces[:,0] != newfaces[:,2])]
+        if not len(newfaces):
+            # too coarse, nothing is left. Keep the previous grid
+            break
+        # faces made of the same clusters are only kept once
+        newfaces = newfaces[numpy.unique(numpy.sort(newfaces,axis=1),axis=0,return_index=True)[1]]
+        result = (len(clusters),inverse,newfaces)
+        if (len(newfaces) <= maxfaces) or (cells == 1):
+            break
+        cells = max(1,cells//2)
+    if not result:
+        return verts,faces
+    count,inverse,newfaces = result
+    # each cluster is placed at the average of its vertices
+    counts = numpy.bincount(inverse,minlength=count).astype(numpy.float64)
+    newverts = numpy.empty((count,3),dtype=verts.dtype)
+    for i in range(3):
+        newverts[:,i] = numpy.bincount(inverse,weights=verts[:,i],minlength=count)/counts
+    # remove the clusters that are not used by any face anymore
+    used,newfaces = numpy.unique(newfaces,return_inverse=True)
+    return newverts[used],newfaces.reshape(-1,3).astype(faces.dtype)
+
+
+def makeMesh(verts,faces):
+
+    """creates a Mesh.Mesh from numpy verts and faces arrays. They are passed
+    to the mesh as a binary STL buffer, so no python object is created per
+    vertex. Versions that can't read a stream get a flat list of triangles"""
+
+    import io
+    import Mesh
+    mesh = Mesh.Mesh()
+    try:
+        mesh.read(Stream=io.BytesIO(getBinarySTL(verts,faces)),Format="STL")
+    except TypeError:
+        # read() only takes a file name before 0.19
+        mesh = Mesh.Mesh(verts[faces].reshape(-1,3).tolist())
+    return mesh
+
+
+def getBinarySTL(verts,faces):
+
+    """returns the contents of a binary STL file made of the given numpy verts
+    and faces arrays. Normals are left empty, the mesh computes them"""
+
+    import numpy
+    facet = numpy.dtype([("normal","<f4",(3,)),("points","<f4",(3,3)),("attribute","<u2")])
+    data = numpy.zeros(len(faces),dtype=facet)
+    data["points"] = verts[faces]
+    return b"\0"*80 + numpy.array([len(faces)],dtype="<u4").tobytes() + data.tobytes()
+
+
+class IfcTessellationCache:
+
+    """A persistent, size-bounded cache of product tessellations, stored in
+    the given directory. Tessellations are stored in packs of two .npy files
+    (vertices and faces) that are memory-mapped when read. Each product is
+    stored under a key made from its GlobalId, the tessellation settings and
+    the contents of its geometry definition, so unchanged products of a
+    modified file are found too. The key of each product of a file is also
+    stored in a manifest named after the file hash, so reopening an
+    unchanged file doesn't need to compute them again. When the packs exceed
+    maxsize bytes, the least recently used ones are deleted"""
+
+    def __init__(self,path,maxsize=1024*1024*1024):
+
+        self.path = path
+        self.maxsize = maxsize
+        self.packs = {} # pack name: (verts,faces) memory-mapped arrays
+        self.entries = {} # key: [pack name, vert start, vert end, face start, face end]
+        self.used = set() # packs used in this session
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        try:
+            with open(os.path.join(self.path,"index.json")) as f:
+                self.entries = json.load(f)
+        except (IOError,OSError,ValueError):
+            self.entries = {}
+
+
+    def getManifestPath(self,filehash,settingskey):
+
+        "returns the path to the manifest of the file with the given hash (see getFileHash)"
+
+        return os.path.join(self.path,hashlib.sha1((filehash+settingskey).encode("utf8")).hexdigest()+".json")
+
+
+    def getManifest(self,filehash,settingskey):
+
+        """returns the {product id: key} dictionary stored for the file with
+        the given hash, which is empty if the file has never been tessellated"""
+
+        return self.loadManifest(self.getManifestPath(filehash,settingskey))
+
+
+    def loadManifest(self,manifest):
+
+        "returns the {product id: key} dictionary stored in the given manifest file"
+
+        try:
+            with open(manifest) as f:
+                return dict([(int(k),v) for k,v in json.load(f).items()])
+        except (IOError,OSError,ValueError):
+            return {}
+
+
+    def getKeys(self,filehash,ifcfile,products,settingskey):
+
+        "returns a {product id: key} dictionary for the given products of the file with the given hash"
+
+        manifest = self.getManifestPath(filehash,settingskey)
+        keys = self.loadManifest(manifest)
+        missing = [p for p in products if not p.id() in keys]
+        if missing:
+            for product in missing:
+                signature = getGeometrySignature(ifcfile,product)
+                key = settingskey+";"+getattr(product,"GlobalId","")+";"+signature
+                keys[product.id()] = hashlib.sha1(key.encode("utf8")).hexdigest()
+            with open(manifest,"w") as f:
+                json.dump(keys,f)
+        else:
+            os.utime(manifest,None)
+        return keys
+
+
+    def get(self,key):
+
+        "returns the (verts,faces) arrays stored under the given key, or None"
+
+        if not key in self.entries:
+            return None
+        pack,vstart,vend,fstart,fend = self.entries[key]
+        if not pack in self.packs:
+            import numpy
+            try:
+                verts = numpy.load(os.path.join(self.path,pack+".verts.npy"),mmap_mode="r")
+                faces = numpy.load(os.path.join(self.path,pack+".faces.npy"),mmap_mode="r")
+            except (IOError,OSError,ValueError):
+                # the pack has been deleted or is broken
+                self.removePack(pack)
+                return None
+            self.packs[pack] = (verts,faces)
+        self.used.add(pack)
+        verts,faces = self.packs[pack]
+        return verts[vstart:vend],faces[fstart:fend]
+
+
+    def add(self,items):
+
+        "stores a list of (key,verts,faces) in a new pack, and saves the cache"
+
+        import numpy
+        if items:
+            pack = uuid.uuid4().hex
+            vstart = 0
+            fstart = 0
+            for key,v,f in items:
+                # faces are stored relative to the vertices of their product
+                self.entries[key] = [pack,vstart,vstart+len(v),fstart,fstart+len(f)]
+                vstart += len(v)
+                fstart += len(f)
+            verts = numpy.concatenate([v for k,v,f in items])
+            faces = numpy.concatenate([f for k,v,f in items])
+            numpy.save(os.path.join(self.path,pack+".verts.npy"),verts)
+            numpy.save(os.path.join(self.path,pack+".faces.npy"),faces)
+            self.used.add(pack)
+        self.save()
+
+
+    def removePack(self,pack):
+
+        "removes a pack and all its entries"
+
+        self.packs.pop(pack,None)
+        self.used.discard(pack)
+        for key in [k for k,v in self.entries.items() if v[0] == pack]:
+            del self.entries[key]
+        for ext in [".verts.npy",".faces.npy"]:
+            if os.path.exists(os.path.join(self.path,pack+ext)):
+                os.remove(os.path.join(self.path,pack+ext))
+
+
+    def save(self):
+
+        "marks the used packs as recent, evicts the oldest ones if needed and saves the index"
+
+        for pack in self.used:
+            for ext in [".verts.npy",".faces.npy"]:
+                if os.path.exists(os.path.join(self.path,pack+ext)):
+                    os.utime(os.path.join(self.path,pack+ext),None)
+        packs = {}
+        for f in os.listdir(self.path):
+            if f.endswith(".verts.npy") or f.endswith(".faces.npy"):
+                stat = os.stat(os.path.join(self.path,f))
+                size,mtime = packs.get(f[:-10],(0,0))
+                packs[f[:-10]] = (size+stat.st_size,max(mtime,stat.st_mtime))
+        size = sum([s for s,m in packs.values()])
+        for pack in sorted(packs,key=lambda p: packs[p][1]):
+            if size <= self.maxsize:
+                break
+            size -= packs[pack][0]
+            self.removePack(pack)
+        manifests = [f for f in os.listdir(self.path) if f.endswith(".json") and f != "index.json"]
+        manifests.sort(key=lambda f: os.path.getmtime(os.path.join(self.path,f)))
+        for f in manifests[:-MAX_MANIFESTS]:
+            os.remove(os.path.join(self.path,f))
+        with open(os.path.join(self.path,"index.json"),"w") as f:
+            json.dump(self.entries,f)
+
+
+def getFileHash(filename):
+
+    "returns a sha1 hash of the contents of the given file"
+
+    h = hashlib.sha1()
+    with open(filename,"rb") as f:
+        while True:
+            chunk = f.read(1024*1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def getGeometrySignature(ifcfile,product,placement=True):
+
+    """returns a sha1 hash of all the entities that define the geometry of
+    the given product (representation, placement and openings), with their
+    ids replaced by their order of appearance, so it doesn't depend on the
+    numbering of the file. If placement is False, the placement of the
+    product is left out, and only the relative placement of its openings
+    is counted, so the signature doesn't change when the product moves"""
+
+    roots = [product.Representation]
+    if placement:
+        roots.append(product.ObjectPlacement)
+    for rel in getattr(product,"HasOpenings",[]):
+        opening = rel.RelatedOpeningElement
+        roots.append(opening.Representation)
+        if placement:
+            roots.append(opening.ObjectPlacement)
+        else:
+            roots.append(getattr(opening.ObjectPlacement,"RelativePlacement",None))
+    entities = []
+    for root in roots:
+        if root:
+            entities.extend(ifcfile.traverse(root))
+    ids = {}
+    for entity in entities:
+        ids.setdefault(entity.id(),len(ids))
+    h = hashlib.sha1()
+    for entity in entities:
+        text = str(entity).split("=",1)[-1]
+        text = re.sub(r"#(\d+)",lambda m: "#"+str(ids.get(int(m.group(1)),m.group(1))),text)
+        h.update(text.encode("utf8"))
+    return h.hexdigest()
@@ -0,0 +1,43 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This module contains small helpers shared by the IFC tools of this
+workbench, that need neither FreeCAD nor ifcopenshell"""
+
+from __future__ import print_function
+
+import csv
+
+
+def writeCSV(filename,header,rows):
+
+    "writes a header row and a list of rows to a CSV file, in python 2 and 3"
+
+    # the csv module wants binary files in python 2 and text files in python 3
+    mode = "wb" if str is bytes else "w"
+    options = {} if str is bytes else {"newline":""}
+    with open(filename,mode,**options) as f:
+        writer = csv.writer(f)
+        for row in [header]+list(rows):
+            if str is bytes:
+                row = [v.encode("utf8") if isinstance(v,unicode) else v for v in row]
+            writer.writerow(row)
@@ -25,6 +25,7 @@
 
 import os
 import FreeCAD
+import BimFingerprint
 from BimTranslateUtils import *
 import importlib
 import inspect
@@ -49,6 +50,15 @@ tests = ["testAll",
          "testRectangleProfileDef",
         ]
 
+
+def isWireOnly(obj):
+
+    "returns True if the shape of the given object has edges but no faces"
+
+    fingerprint = BimFingerprint.getFingerprint(obj)
+    return bool(fingerprint.edges and not fingerprint.faces)
+
+
 class BIM_Preflight:
 
 
@@ -226,7 +236,7 @@ class BIM_Preflight_TaskPanel:
         objs = Draft.getGroupContents(objs,walls=True,addgroups=True)
         objs = [obj for obj in objs if not obj.isDerivedFrom("Part::Part2DObject")]
         objs = [obj for obj in objs if not obj.isDerivedFrom("App::Annotation")]
-        objs = [obj for obj in objs if (hasattr(obj,"Shape") and obj.Shape and not (obj.Shape.Edges and (not obj.Shape.Faces)))]
+        objs = [obj for obj in objs if (hasattr(obj,"Shape") and obj.Shape and not isWireOnly(obj))]
         objs = Arch.pruneIncluded(objs)
         objs = [obj for obj in objs if not obj.isDerivedFrom("App::DocumentObjectGroup")]
         objs = [obj for obj in objs if Draft.getType(obj) not in ["DraftText","Material","MaterialContainer","WorkingPlaneProxy"]]
@@ -510,7 +520,8 @@ class BIM_Preflight_TaskPanel:
 
             for obj in self.getObjects():
                 if obj.isDerivedFrom("Part::Feature"):
-                    if (not obj.Shape.isNull()) and ((not obj.Shape.isValid()) or (not obj.Shape.Solids)):
+                    fingerprint = BimFingerprint.getFingerprint(obj)
+                    if (not fingerprint.null) and ((not fingerprint.solids) or (not obj.Shape.isValid())):
                         self.culprits[test].append(obj)
             if self.culprits[test]:
                 msg = self.getToolTip(test)